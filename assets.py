@@ -0,0 +1,78 @@
+""" Images loaded once and shared by every sprite that uses them.
+"""
+import pygame
+
+
+class AssetManager(object):
+    """ Loads, converts and caches images, once per filename.
+    """
+    def __init__(self):
+        # filename -> converted Surface
+        #
+        self._images = {}
+        # Filenames of images loaded before there was a display
+        # to convert them for
+        #
+        self._unconverted = set()
+        self.loads = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, filename):
+        return filename in self._images
+
+    def image(self, filename):
+        """ The image from filename, loaded on first use.
+
+            Images are converted to the display's pixel format
+            (with alpha) on their first use once a display mode
+            is set, including images loaded before it was.
+        """
+        image = self._images.get(filename)
+        if image is None:
+            image = self._images[filename] = pygame.image.load(filename)
+            self._unconverted.add(filename)
+            self.loads += 1
+        else:
+            self.hits += 1
+        if filename in self._unconverted and \
+                pygame.display.get_surface() is not None:
+            image = self._images[filename] = image.convert_alpha()
+            self._unconverted.discard(filename)
+        return image
+
+    def preload(self, filenames):
+        """ Load the images from filenames now, so that spawning
+            sprites later does no loading.
+        """
+        for filename in filenames:
+            if filename not in self._images:
+                self.image(filename)
+
+    def clear(self):
+        """ Forget all the images.
+        """
+        self._images.clear()
+        self._unconverted.clear()
+
+    def memory(self):
+        """ Bytes of pixel data held by the cached images.
+        """
+        return sum(
+            image.get_pitch() * image.get_height()
+            for image in self._images.values())
+
+    def stats(self):
+        return {
+            'images': len(self),
+            'loads': self.loads,
+            'hits': self.hits,
+            'bytes': self.memory(),
+        }
+
+
+# The images shared by all the creeps
+#
+ASSETS = AssetManager()
@@ -0,0 +1,383 @@
+"""Micro-benchmarks for the drawing pipeline.
+
+Run all of them with `python bench.py`, or pick some by name, e.g.
+`python bench.py transform`.
+"""
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import numpy as np
+import pygame
+
+import assets
+import creeps
+import drawing
+import geometry
+import headless
+import mechanism
+import profiling
+import spatial
+import sweep
+import tracing
+import travel
+
+
+def best_time(fn, repeat=5, number=None):
+    """Best wall time (in seconds) of a single call to `fn`"""
+    timer = timeit.Timer(fn)
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number))/number
+
+def report(name, n, seconds):
+    print("%-32s n=%-9d %10.3f ms %14.0f /s" % (
+        name, n, 1e3*seconds, n/seconds))
+
+def report_frame(name, seconds):
+    print("%-32s %10.3f ms/frame %8.0f fps" % (name, 1e3*seconds, 1/seconds))
+
+
+##############
+# Benchmarks #
+##############
+
+def _loop_transform(vectors, offset=[0,0], angle=0, scale=1.0):
+    """The per-vector transform that geometry.transform used to do"""
+    angle_rad = np.radians(angle)
+    c = np.cos(angle_rad)
+    s = np.sin(angle_rad)
+    R = np.array([[c, -s],[s, c]])
+    return offset + scale*np.array([np.dot(R,v) for v in vectors])
+
+def bench_transform(sizes=(100, 10**4, 10**6)):
+    """Throughput of geometry.transform against the per-vector loop"""
+    for n in sizes:
+        pts = np.random.random((n,2))
+        seconds = best_time(
+            lambda: geometry.transform(pts, [1,2], angle=30, scale=2.0))
+        report("transform", n, seconds)
+        # The per-vector loop takes seconds at 1e6 points; one run is enough
+        seconds = best_time(
+            lambda: _loop_transform(pts, [1,2], angle=30, scale=2.0),
+            repeat=1 if n > 10**5 else 3)
+        report("transform (per-vector loop)", n, seconds)
+
+def _per_point_draw_lines(canvas, lines):
+    """The per-point Canvas.draw_lines that predates project_lines"""
+    for lineset in lines:
+        lineset = [canvas.world_coords(pt) for pt in lineset]
+        pygame.draw.aalines(canvas.rect, [0]*3, False, lineset)
+
+def bench_draw_lines():
+    """Frame time of drawing the mechanism, per point versus batched"""
+    canvas = drawing.Canvas(pygame.Surface((600,600)), scale=0.7)
+    mech = mechanism.MechanismDrawing(mechanism.MechanismModel())
+    lines = mech.draw_mechanism()
+
+    def per_point():
+        canvas.clear_canvas()
+        _per_point_draw_lines(canvas, lines)
+
+    def batched():
+        canvas.clear_canvas()
+        canvas.draw_lines(lines)
+
+    report_frame("draw_lines (per point)", best_time(per_point))
+    report_frame("draw_lines (batched)", best_time(batched))
+
+def bench_sweep(n=10**4):
+    """Mechanism configurations evaluated per second, one MechanismDrawing at
+    a time versus evaluate_configs"""
+    params = np.random.random((4,n))*[[360], [360], [5], [3]] + [[0],[0],[5],[3]]
+    mech = mechanism.MechanismDrawing(mechanism.MechanismModel())
+
+    def one_at_a_time():
+        for disc_angle, arm_angle, arm_length, disc_radius in params.T[:n//10]:
+            mech.model.disc_angle = disc_angle
+            mech.model.arm_angle = arm_angle
+            mech.model.arm_length = arm_length
+            mech.model.disc_radius = disc_radius
+            mech.draw_mechanism()
+
+    report("sweep (MechanismDrawing)", n//10, best_time(one_at_a_time, 3))
+    report("sweep (evaluate_configs)", n,
+           best_time(lambda: mechanism.evaluate_configs(*params), 3))
+
+def bench_sweep_pool(n_angles=60):
+    """Configurations per second of a sharded sweep, by number of processes"""
+    grid = sweep.ParameterGrid(
+        np.linspace(0, 360, n_angles), np.linspace(0, 360, n_angles),
+        np.linspace(5, 10, 10), np.linspace(3, 6, 10))
+    processes = 1
+    while processes <= multiprocessing.cpu_count():
+        out_dir = tempfile.mkdtemp()
+        try:
+            executor = sweep.SweepExecutor(
+                out_dir, chunk_size=20000, processes=processes)
+            seconds = best_time(lambda: executor.run(grid), repeat=1, number=1)
+        finally:
+            shutil.rmtree(out_dir)
+        report("sweep (%d processes)" % processes, len(grid), seconds)
+        processes *= 2
+
+def bench_lod(duration=500):
+    """Frame time of drawing a long pen trace, with and without level of
+    detail, at a few zoom levels"""
+    path = np.concatenate(list(tracing.trace(90, 37, duration, dt=0.001)))
+    canvas = drawing.Canvas(pygame.Surface((600,600)))
+    for scale in [0.1, 0.7, 5.0]:
+        canvas.coords.scale = scale
+
+        def frame():
+            canvas.clear_canvas()
+            canvas.draw_lines([path])
+
+        canvas.lod.min_points = len(path) + 1
+        report_frame("trace %d pts x%.1f (all)" % (len(path), scale),
+                     best_time(frame, repeat=1, number=3))
+        canvas.lod.min_points = 64
+        frame()
+        report_frame("trace %d pts x%.1f (lod)" % (len(path), scale),
+                     best_time(frame))
+
+def bench_cull(duration=500):
+    """Frame time of drawing a long pen trace zoomed in, through draw_lines
+    versus through a spatial.SegmentGrid"""
+    path = np.concatenate(list(tracing.trace(90, 37, duration, dt=0.001)))
+    canvas = drawing.Canvas(pygame.Surface((600,600)))
+    index = spatial.SegmentGrid([path])
+    for scale in [0.7, 5.0, 20.0]:
+        canvas.coords.scale = scale
+
+        def lines():
+            canvas.clear_canvas()
+            canvas.draw_lines([path])
+
+        def indexed():
+            canvas.clear_canvas()
+            canvas.draw_index(index)
+
+        lines()
+        report_frame("trace x%.1f (draw_lines)" % scale, best_time(lines))
+        report_frame("trace x%.1f (draw_index)" % scale, best_time(indexed))
+        print("  %(drawn)d segments drawn, %(culled)d culled" %
+              canvas.cull_stats)
+
+def _strokes(n, clustered, rng):
+    """Synthetic drawing of n short strokes, spread evenly over the page or
+    bunched into clusters"""
+    if clustered:
+        centers = rng.random((max(n//500, 1), 2))*200
+        starts = centers[rng.integers(len(centers), size=n)] + \
+                 rng.normal(scale=5, size=(n,2))
+    else:
+        starts = rng.random((n,2))*200
+    steps = rng.normal(scale=0.5, size=(n,5,2))
+    return list(starts[:,None,:] + np.cumsum(steps, axis=1))
+
+def bench_travel(sizes=(1000, 10000, 100000)):
+    """Pen-up travel of synthetic drawings before and after travel.optimize"""
+    rng = np.random.default_rng(0)
+    for clustered in [False, True]:
+        for n in sizes:
+            paths = _strokes(n, clustered, rng)
+            seconds = best_time(lambda: travel.optimize(paths),
+                                repeat=1, number=1)
+            _, result = travel.optimize(paths)
+            print("%-10s n=%-7d %9.3f s  pen up %12.1f -> %10.1f "
+                  "(nearest neighbour %10.1f)" % (
+                      "clustered" if clustered else "uniform", n, seconds,
+                      result['before'], result['after'],
+                      result['nearest_neighbour']))
+
+def _creep_swarm(n, rng, screen_size=(400,400)):
+    """n creeps at random on the screen, as creeps.run_game makes them"""
+    images = [pygame.image.load(f) for f in creeps.CREEP_FILENAMES]
+    return creeps.CreepSwarm(
+        screen_size, rng.random((n,2))*screen_size,
+        rng.choice([-1,1], (n,2)), 0.1, rng.integers(len(images), size=n),
+        creeps.rotated_sizes(creeps.rotated_images(images)), rng)
+
+def bench_creeps(sizes=(1000, 10**4, 10**5)):
+    """Creep updates per second, as Creep objects versus a CreepSwarm"""
+    headless.init()
+    screen = pygame.display.set_mode((400,400))
+    rng = np.random.default_rng(0)
+    swarm = _creep_swarm(sizes[0], rng)
+    sprites = [creeps.Creep(screen, creeps.CREEP_FILENAMES[i], tuple(p),
+                            tuple(d), 0.1)
+               for (i, p, d) in zip(swarm.image_ids, swarm.pos,
+                                    swarm.direction)]
+
+    def per_creep():
+        for creep in sprites:
+            creep.update(20)
+
+    report("creeps (Creep.update)", len(sprites), best_time(per_creep))
+    for n in sizes:
+        swarm = _creep_swarm(n, rng)
+        report("creeps (CreepSwarm)", n, best_time(lambda: swarm.update(20)))
+
+def bench_spawn(sizes=(100, 1000, 10**4)):
+    """Time to spawn creeps with shared images, against loading each
+    creep's image itself"""
+    headless.init()
+    screen = pygame.display.set_mode((400,400))
+    files = creeps.CREEP_FILENAMES
+
+    def spawn(n, manager):
+        return [creeps.Creep(screen, files[i % 3], (200,200), (1,1), 0.1,
+                             assets=manager)
+                for i in range(n)]
+
+    def load_each(n):
+        return [pygame.image.load(files[i % 3]).convert_alpha()
+                for i in range(n)]
+
+    for n in sizes:
+        seconds = best_time(lambda: spawn(n, assets.AssetManager()), repeat=3)
+        report("spawn (AssetManager)", n, seconds)
+        report("spawn (image load per creep)", n,
+               best_time(lambda: load_each(n), repeat=1, number=1))
+    manager = assets.AssetManager()
+    manager.preload(files)
+    print("  %(images)d images, %(bytes)d bytes" % manager.stats())
+
+def bench_blit(sizes=(20, 1000, 10**4)):
+    """Frame time of drawing creeps: a blit per creep and a full-screen
+    flip, against batched blits and dirty rects"""
+    headless.init()
+    screen = pygame.display.set_mode((400,400))
+    background = pygame.Surface(screen.get_size())
+    background.fill((150,150,80))
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        swarm = _creep_swarm(n, rng)
+        sprites = [creeps.Creep(screen, creeps.CREEP_FILENAMES[i], tuple(p),
+                                tuple(d), 0.1)
+                   for (i, p, d) in zip(swarm.image_ids, swarm.pos,
+                                        swarm.direction)]
+        for creep in sprites:
+            creep.update(20)
+        swarm = creeps.CreepSwarm.from_creeps(sprites, rng)
+
+        def per_creep():
+            screen.fill((150,150,80))
+            for creep in sprites:
+                creep.blitme()
+            pygame.display.flip()
+
+        dirty_rects = [[]]
+        def batched():
+            dirty_rects[0] = creeps.draw_frame(
+                screen, background, swarm, dirty_rects[0])
+
+        report_frame("blit %d creeps (per creep)" % n, best_time(per_creep))
+        report_frame("blit %d creeps (batched)" % n, best_time(batched))
+
+def bench_simulation(sizes=(1000, 10**4, 10**5), ticks=50):
+    """Fixed-step creep simulation throughput, in ticks per second"""
+    for n in sizes:
+        sim = creeps.CreepSimulation((400,400), n, seed=0)
+        seconds = best_time(lambda: sim.step(ticks), repeat=3, number=1)
+        report("simulation ticks (%d creeps)" % n, ticks, seconds)
+
+def bench_allocations(n=10**4, ticks=10):
+    """Bytes allocated per tick by updating and drawing Creep objects"""
+    headless.init()
+    screen = pygame.display.set_mode((400,400))
+    rng = np.random.default_rng(0)
+    positions = (rng.random((n,2))*400).tolist()
+    directions = rng.choice([-1,1], (n,2)).tolist()
+    # Trace from the start, so replacing untraced objects isn't
+    # counted as retained
+    tracemalloc.start()
+    sprites = [creeps.Creep(screen, creeps.CREEP_FILENAMES[i % 3], p, d, 0.1)
+               for (i, p, d) in zip(range(n), positions, directions)]
+    updates = [lambda creep=creep: creep.update(20) for creep in sprites]
+    blits = [creep.blitme for creep in sprites]
+    for (name, calls) in [('update', updates), ('blitme', blits)]:
+        stats = creeps.allocations(calls, ticks, warmup=10)
+        print("%-10s %d creeps: %10.0f bytes/tick allocated, %8.0f retained" %
+              (name, n, stats['bytes'], stats['retained']))
+    tracemalloc.stop()
+
+def _brute_force_collisions(swarm, rows=None):
+    """Colliding pairs of the swarm by checking every pair, a block of
+    rows at a time (only the first `rows` rows if given)"""
+    sizes = swarm.sizes()
+    n = len(swarm) if rows is None else rows
+    pairs = 0
+    for start in range(0, n, 500):
+        i = np.arange(start, min(start + 500, n))
+        gap = np.abs(swarm.pos[i,None] - swarm.pos[None])
+        overlap = (2*gap < sizes[i,None] + sizes[None]).all(axis=2)
+        overlap &= np.arange(len(swarm)) > i[:,None]
+        pairs += overlap.sum()
+    return pairs
+
+def bench_collisions(sizes=(1000, 10**4, 10**5)):
+    """Creep collision queries on a spatial hash against checking all
+    pairs, with about 20x20 px of screen per creep"""
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        side = int(20*np.sqrt(n))
+        swarm = _creep_swarm(n, rng, (side, side))
+
+        def hashed():
+            swarm.invalidate()
+            return swarm.collisions()
+
+        seconds = best_time(hashed, repeat=3)
+        report("collisions (spatial hash)", n, seconds)
+        print("  %d colliding pairs" % len(hashed()[0]))
+        # All pairs takes minutes at 1e5 creeps, so time some rows of it
+        rows = min(n, 2000)
+        seconds = best_time(lambda: _brute_force_collisions(swarm, rows),
+                            repeat=1, number=1)
+        report("collisions (all pairs%s)" % (
+            ", est." if rows < n else ""), n, seconds*n/rows)
+
+def bench_profiling(n=10**5):
+    """Cost of timing a stage with a profiler which is off or on, against
+    the bare loop"""
+    def loop(profiler):
+        for i in range(n):
+            with profiler.stage('update'):
+                pass
+
+    def bare():
+        for i in range(n):
+            pass
+
+    report("stages (no profiler)", n, best_time(bare, repeat=3))
+    report("stages (profiler off)", n,
+           best_time(lambda: loop(profiling.Profiler()), repeat=3))
+    report("stages (profiler on)", n,
+           best_time(lambda: loop(profiling.Profiler(enabled=True)), repeat=3))
+
+
+BENCHMARKS = {
+    'transform': bench_transform,
+    'draw_lines': bench_draw_lines,
+    'sweep': bench_sweep,
+    'sweep_pool': bench_sweep_pool,
+    'lod': bench_lod,
+    'cull': bench_cull,
+    'travel': bench_travel,
+    'creeps': bench_creeps,
+    'spawn': bench_spawn,
+    'blit': bench_blit,
+    'simulation': bench_simulation,
+    'allocations': bench_allocations,
+    'collisions': bench_collisions,
+    'profiling': bench_profiling,
+}
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or list(BENCHMARKS):
+        BENCHMARKS[name]()
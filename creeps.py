@@ -1,20 +1,146 @@
 import os, sys
-from random import randint, choice
+import gc
+import random
+import tracemalloc
 from math import sin, cos, radians
 
+import numpy as np
 import pygame
 from pygame.sprite import Sprite
 
+import profiling
+import spatial
+from assets import ASSETS
 from vec2d import vec2d
 
 
+# The creep images
+#
+CREEP_FILENAMES = [
+    'bluecreep.png',
+    'pinkcreep.png',
+    'graycreep.png']
+
+
+# (cos, sin) of the turns creeps make (-45, 0 and 45 degrees),
+# exactly as vec2d.rotate uses them
+#
+_TURN_COS_SIN = np.array(
+    [tuple(vec2d(1, 0).rotated(45 * turn)) for turn in (-1, 0, 1)])
+
+
+class RotationCache(object):
+    """ Creep images rotated to each multiple of 45 degrees,
+        shared by all creeps and keyed by (image file, angle).
+        The rotations of an image are all made when it is
+        loaded, so creeps never rotate images as they move.
+    """
+    def __init__(self):
+        # filename -> [(image, width, height)] for each octant
+        # (the angle in multiples of 45 degrees), so that
+        # lookups build no key
+        #
+        self._rotations = {}
+        # filename -> the image the rotations were made from
+        #
+        self._bases = {}
+        # (filename, screen size) -> [(left, right, top, bottom)]
+        # for each octant: the bounds of the walls for a creep
+        # with that rotation of the image
+        #
+        self._bounds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return 8 * len(self._rotations)
+
+    def load(self, img_filename, base_image):
+        """ Rotate base_image, loaded from img_filename, to
+            every multiple of 45 degrees (unless it already was).
+            A new base_image for the file, such as the image
+            converted once there is a display, replaces the
+            rotations of the old one.
+        """
+        if self._bases.get(img_filename) is base_image:
+            return
+        rotations = []
+        for octant in range(8):
+            # The angle is inverted, as rotate() rotates
+            # counter-clockwise (see Creep.update)
+            #
+            image = pygame.transform.rotate(base_image, -45 * octant)
+            rotations.append((image,) + image.get_size())
+        self._rotations[img_filename] = rotations
+        self._bases[img_filename] = base_image
+        for key in [key for key in self._bounds if key[0] == img_filename]:
+            del self._bounds[key]
+
+    def get(self, img_filename, angle):
+        """ (image, width, height) of the image from img_filename
+            rotated to angle (in degrees), to the nearest 45.
+        """
+        octant = _octant(angle)
+        rotations = self._rotations.get(img_filename)
+        if rotations is not None:
+            self.hits += 1
+            return rotations[octant]
+        self.misses += 1
+        self.load(img_filename, ASSETS.image(img_filename))
+        return self._rotations[img_filename][octant]
+
+    def bounds(self, img_filename, screen_rect):
+        """ (left, right, top, bottom) bounds of the walls on
+            screen_rect for a creep with each rotation of the
+            image from img_filename, by octant.  Worked out once
+            for each size of screen.
+        """
+        key = (img_filename, screen_rect.size)
+        bounds = self._bounds.get(key)
+        if bounds is None:
+            bounds = self._bounds[key] = []
+            for (image, w, h) in self._rotations[img_filename]:
+                rect = screen_rect.inflate(-w, -h)
+                bounds.append((rect.left, rect.right, rect.top, rect.bottom))
+        return bounds
+
+    def rotations(self, img_filename):
+        """ The 8 rotations of a loaded image, from 0 degrees
+            on, as (image, width, height).
+        """
+        return list(self._rotations[img_filename])
+
+    def stats(self):
+        """ Number of cached images, and how often get found
+            the rotation it wanted.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / float(lookups) if lookups else 0.0,
+        }
+
+
+# The rotations of all the creep images
+#
+ROTATIONS = RotationCache()
+
+
+def _octant(angle):
+    """ The multiple of 45 degrees nearest to angle, from 0 to 7.
+    """
+    return int(round(angle / 45.)) % 8
+
+
 class Creep(Sprite):
     """ A creep sprite that bounces off walls and changes its
         direction from time to time.
     """
     def __init__(
             self, screen, img_filename, init_position,
-            init_direction, speed):
+            init_direction, speed, assets=ASSETS, rng=random):
         """ Create a new Creep.
 
             screen:
@@ -35,26 +161,55 @@ class Creep(Sprite):
 
             speed:
                 Creep speed, in pixels/millisecond (px/ms)
+
+            assets:
+                The AssetManager to get the image from, so that
+                creeps share their images.
+
+            rng:
+                A random.Random for the direction changes (by
+                default, the random module's shared one).
         """
         Sprite.__init__(self)
 
         self.screen = screen
         self.speed = speed
+        self.img_filename = img_filename
+        self.rng = rng
 
         # base_image holds the original image, positioned to
         # angle 0.
         # image will be rotated.
         #
-        self.base_image = pygame.image.load(img_filename).convert_alpha()
+        self.base_image = assets.image(img_filename)
         self.image = self.base_image
+        ROTATIONS.load(img_filename, self.base_image)
 
-        # A vector specifying the creep's position on the screen
+        # A vector specifying the creep's position on the screen.
+        # Components are plain floats (not, say, numpy scalars),
+        # which Python recycles rather than allocating anew.
         #
-        self.pos = vec2d(init_position)
+        self.pos = vec2d(float(init_position[0]), float(init_position[1]))
 
         # The direction is a normalized vector
         #
-        self.direction = vec2d(init_direction).normalized()
+        self.direction = vec2d(
+            float(init_direction[0]), float(init_direction[1])).normalized()
+
+        # So that updates allocate nothing, the bounds of the
+        # walls are worked out up front for each rotation of
+        # the image (by octant, so they outlast the images being
+        # loaded again), and blitme moves one rect about.  The
+        # screen is taken not to change size.
+        #
+        self._screen_rect = screen.get_rect()
+        self._bounds = ROTATIONS.bounds(img_filename, self._screen_rect)
+        self._walls = None
+        self._draw_rect = pygame.Rect(0, 0, 0, 0)
+
+        # The angle image was rotated to
+        #
+        self._image_angle = None
 
     def update(self, time_passed):
         """ Update the creep.
@@ -69,97 +224,560 @@ class Creep(Sprite):
         # Make the creep point in the correct direction.
         # Since our direction vector is in screen coordinates
         # (i.e. right bottom is 1, 1), and rotate() rotates
-        # counter-clockwise, the angle must be inverted to
-        # work correctly.
+        # counter-clockwise, the cached images are rotated by
+        # the inverted angle. The image only changes when the
+        # direction does.
         #
-        self.image = pygame.transform.rotate(
-            self.base_image, -self.direction.angle)
-
-        # Compute and apply the displacement to the position
-        # vector. The displacement is a vector, having the angle
-        # of self.direction (which is normalized to not affect
+        angle = self.direction.angle
+        if angle != self._image_angle:
+            self.image, self.image_w, self.image_h = ROTATIONS.get(
+                self.img_filename, angle)
+            self._walls = self._bounds[_octant(angle)]
+            self._image_angle = angle
+
+        # Apply the displacement to the position vector, in
+        # place. The displacement has the angle of
+        # self.direction (which is normalized to not affect
         # the magnitude of the displacement)
         #
-        displacement = vec2d(
-            self.direction.x * self.speed * time_passed,
-            self.direction.y * self.speed * time_passed)
-
-        self.pos += displacement
+        pos = self.pos
+        direction = self.direction
+        pos.x += direction.x * self.speed * time_passed
+        pos.y += direction.y * self.speed * time_passed
 
         # When the image is rotated, its size is changed.
         # We must take the size into account for detecting
         # collisions with the walls.
         #
-        self.image_w, self.image_h = self.image.get_size()
-        bounds_rect = self.screen.get_rect().inflate(
-                        -self.image_w, -self.image_h)
-
-        if self.pos.x < bounds_rect.left:
-            self.pos.x = bounds_rect.left
-            self.direction.x *= -1
-        elif self.pos.x > bounds_rect.right:
-            self.pos.x = bounds_rect.right
-            self.direction.x *= -1
-        elif self.pos.y < bounds_rect.top:
-            self.pos.y = bounds_rect.top
-            self.direction.y *= -1
-        elif self.pos.y > bounds_rect.bottom:
-            self.pos.y = bounds_rect.bottom
-            self.direction.y *= -1
+        left, right, top, bottom = self._walls
+
+        if pos.x < left:
+            pos.x = left
+            direction.x *= -1
+        elif pos.x > right:
+            pos.x = right
+            direction.x *= -1
+        elif pos.y < top:
+            pos.y = top
+            direction.y *= -1
+        elif pos.y > bottom:
+            pos.y = bottom
+            direction.y *= -1
 
     def blitme(self):
         """ Blit the creep onto the screen that was provided in
             the constructor.
         """
+        # As in blit_args, but placing a rect kept for the
+        # purpose (setting its position rounds, so truncate
+        # like blit does).  blit itself still returns a new
+        # Rect, which is freed straight away.
+        #
+        draw_rect = self._draw_rect
+        draw_rect.x = int(self.pos.x - self.image_w / 2)
+        draw_rect.y = int(self.pos.y - self.image_h / 2)
+        self.screen.blit(self.image, draw_rect)
+
+    def blit_args(self):
+        """ The (image, position) to blit the creep with.
+        """
         # The creep image is placed at self.pos.
         # To allow for smooth movement even when the creep rotates
         # and the image size changes, its placement is always
         # centered.
         #
-        draw_pos = self.image.get_rect().move(
+        return (self.image, (
             self.pos.x - self.image_w / 2,
-            self.pos.y - self.image_h / 2)
-        self.screen.blit(self.image, draw_pos)
+            self.pos.y - self.image_h / 2))
 
     #------------------ PRIVATE PARTS ------------------#
 
-    _counter = 0
+    _counter = 0.0
 
     def _change_direction(self, time_passed):
         """ Turn by 45 degrees in a random direction once per
             0.4 to 0.5 seconds.
         """
+        # The counter is a float, as floats are recycled rather
+        # than allocated.  The random limit only matters between
+        # 400 and 500, so it's only drawn then.
+        #
         self._counter += time_passed
-        if self._counter > randint(400, 500):
-            self.direction.rotate(45 * randint(-1, 1))
-            self._counter = 0
+        counter = self._counter
+        if counter > 400 and (
+                counter > 500 or counter > self.rng.randint(400, 500)):
+            self.direction.rotate(45 * self.rng.randint(-1, 1))
+            self._counter = 0.0
+
+
+class CreepSwarm(object):
+    """ Many creeps at once, kept as arrays (one row per creep)
+        rather than as Creep objects, and updated with
+        vectorized operations.  Each update behaves like
+        Creep.update on every creep.
+    """
+    def __init__(
+            self, screen_size, positions, directions, speeds,
+            image_ids=None, image_sizes=None, rng=None):
+        """ Create a new CreepSwarm.
 
+            screen_size:
+                (width, height) of the screen the creeps live on.
 
-def run_game():
+            positions, directions:
+                (N, 2) arrays of the creeps' positions and
+                directions. Directions must have angles that are
+                multiples of 45 degrees.
+
+            speeds:
+                Creep speeds, in px/ms (an array, or one for all)
+
+            image_ids, image_sizes:
+                Which image each creep has, and the (width, height)
+                of each image rotated to each multiple of 45
+                degrees, as an (images, 8, 2) array (see
+                rotated_sizes). Without them, creeps have no size.
+
+            rng:
+                numpy random Generator for the direction changes.
+        """
+        self.width, self.height = screen_size
+        self.pos = np.array(positions, dtype=float).reshape(-1, 2)
+        n = len(self.pos)
+
+        directions = np.array(directions, dtype=float).reshape(-1, 2)
+        self.direction = directions / np.hypot(
+            directions[:, 0], directions[:, 1])[:, None]
+
+        # The angle of each direction in multiples of 45 degrees
+        # (0 to 7), kept exact as the directions turn and bounce.
+        #
+        angles = np.degrees(np.arctan2(
+            self.direction[:, 1], self.direction[:, 0]))
+        self.octant = np.round(angles / 45).astype(int) % 8
+
+        self.speed = np.broadcast_to(
+            np.asarray(speeds, dtype=float), (n,)).copy()
+        self.counter = np.zeros(n)
+
+        if image_ids is None:
+            image_ids = np.zeros(n, dtype=int)
+        if image_sizes is None:
+            image_sizes = np.zeros((1, 8, 2), dtype=int)
+        self.image_ids = np.asarray(image_ids, dtype=int)
+        self.image_sizes = np.asarray(image_sizes, dtype=int)
+
+        # Rotated images to draw the creeps with, as from
+        # rotated_images
+        #
+        self.images = None
+
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        # Spatial hashes of the creeps' positions, by cell size,
+        # until the positions change
+        #
+        self._grids = {}
+
+    def __len__(self):
+        return len(self.pos)
+
+    @property
+    def pos(self):
+        """ (N, 2) array of the creeps' positions.  Assigning
+            to it is fine; after changing it in place, call
+            invalidate().
+        """
+        return self._pos
+
+    @pos.setter
+    def pos(self, positions):
+        self._pos = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.invalidate()
+
+    def invalidate(self):
+        """ Forget the grids over the creeps' positions, which
+            have changed.
+        """
+        self._grids = {}
+
+    def sizes(self):
+        """ (N, 2) sizes of the creeps' images, as rotated to
+            their current directions.
+        """
+        return self.image_sizes[self.image_ids, self.octant]
+
+    def update(self, time_passed):
+        """ Update all the creeps.
+
+            time_passed:
+                The time passed (in ms) since the previous update.
+        """
+        self._change_direction(time_passed)
+
+        self.pos += self.direction * (self.speed * time_passed)[:, None]
+        self.invalidate()
+
+        # The bounds Creep.update gets by inflating the screen
+        # rect by minus the rotated image size.
+        #
+        w, h = self.sizes().T
+        left, top = w // 2, h // 2
+        right = self.width - w + left
+        bottom = self.height - h + top
+
+        # Like Creep.update, only one wall is handled per update
+        #
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        hit_left = x < left
+        hit_right = ~hit_left & (x > right)
+        rest = ~(hit_left | hit_right)
+        hit_top = rest & (y < top)
+        hit_bottom = rest & ~hit_top & (y > bottom)
+
+        x[hit_left] = left[hit_left]
+        x[hit_right] = right[hit_right]
+        y[hit_top] = top[hit_top]
+        y[hit_bottom] = bottom[hit_bottom]
+
+        flip_x = hit_left | hit_right
+        flip_y = hit_top | hit_bottom
+        self.direction[flip_x, 0] *= -1
+        self.direction[flip_y, 1] *= -1
+        self.octant[flip_x] = (4 - self.octant[flip_x]) % 8
+        self.octant[flip_y] = -self.octant[flip_y] % 8
+
+    def grid(self, cell_size=None):
+        """ spatial.PointGrid over the creeps' positions, made at
+            most once until they change (see pos).
+
+            cell_size:
+                Grid cell size, by default the largest image size
+                (so creeps whose images overlap are in the same
+                or neighbouring cells).
+        """
+        if cell_size is None:
+            cell_size = max(self.image_sizes.max(), 1)
+        if cell_size not in self._grids:
+            self._grids[cell_size] = spatial.PointGrid(self.pos, cell_size)
+        return self._grids[cell_size]
+
+    def neighbours(self, i, radius):
+        """ Indices of the other creeps within radius of creep i.
+        """
+        found = self.grid().within(self.pos[i], radius)
+        return found[found != i]
+
+    def close_pairs(self, radius):
+        """ Index arrays (a, b) of the pairs of creeps within
+            radius of each other, each pair once (a < b).
+        """
+        cell_size = max(radius, self.image_sizes.max(), 1)
+        a, b = self.grid(cell_size).pairs(radius)
+        return _ordered_pairs(a, b)
+
+    def collisions(self):
+        """ Index arrays (a, b) of the pairs of creeps whose
+            (rotated) images overlap, each pair once (a < b).
+        """
+        a, b = self.grid().pairs()
+        sizes = self.sizes()
+        gap = np.abs(self.pos[a] - self.pos[b])
+        overlap = (2 * gap < sizes[a] + sizes[b]).all(axis=1)
+        return _ordered_pairs(a[overlap], b[overlap])
+
+    def draw(self, screen):
+        """ Blit all the creeps onto screen in one go, centered
+            on their positions like Creep.blitme, returning the
+            rects drawn to.
+        """
+        images = [image for row in self.images for image in row]
+        keys = 8 * self.image_ids + self.octant
+        corners = self.pos - self.sizes() / 2
+        return screen.blits(
+            zip([images[k] for k in keys.tolist()],
+                map(tuple, corners.tolist())))
+
+    #------------------ PRIVATE PARTS ------------------#
+
+    def _change_direction(self, time_passed):
+        """ Turn by 45 degrees in a random direction once per
+            0.4 to 0.5 seconds.
+        """
+        self.counter += time_passed
+
+        # Creep draws randint(400, 500) afresh each update, so
+        # only counters in between need a draw
+        #
+        due = self.counter > 500
+        maybe = np.flatnonzero((self.counter > 400) & ~due)
+        due[maybe] = \
+            self.counter[maybe] > self.rng.integers(400, 501, len(maybe))
+
+        turning = np.flatnonzero(due)
+        turns = self.rng.integers(-1, 2, len(turning))
+        c, s = _TURN_COS_SIN[turns + 1].T
+        x, y = self.direction[turning].T
+        self.direction[turning] = np.stack([x*c - y*s, x*s + y*c], axis=-1)
+        self.octant[turning] = (self.octant[turning] + turns) % 8
+        self.counter[turning] = 0
+
+    @classmethod
+    def from_creeps(cls, creeps, rng=None):
+        """ A CreepSwarm in the same state as a list of Creeps.
+        """
+        filenames = []
+        image_ids = []
+        for creep in creeps:
+            if creep.img_filename not in filenames:
+                filenames.append(creep.img_filename)
+            image_ids.append(filenames.index(creep.img_filename))
+        rotated = [[image for (image, w, h) in ROTATIONS.rotations(f)]
+                   for f in filenames]
+        swarm = cls(
+            creeps[0].screen.get_size(),
+            [tuple(creep.pos) for creep in creeps],
+            [tuple(creep.direction) for creep in creeps],
+            [creep.speed for creep in creeps],
+            image_ids, rotated_sizes(rotated), rng)
+        swarm.counter[:] = [creep._counter for creep in creeps]
+        swarm.images = rotated
+        return swarm
+
+
+class CreepSimulation(object):
+    """ A swarm of random creeps moved in fixed time steps,
+        apart from any drawing of them, so that runs with the
+        same seed always come out the same.
+    """
+    def __init__(
+            self, screen_size, n_creeps, seed=None, time_step=20,
+            speed=0.1, img_filenames=CREEP_FILENAMES, assets=ASSETS):
+        """ Create a new CreepSimulation.
+
+            screen_size:
+                (width, height) of the screen the creeps live on.
+
+            n_creeps:
+                Number of creeps, placed and pointed at random
+                like run_game places them.
+
+            seed:
+                Seed for the simulation's own random generator.
+
+            time_step:
+                Time (in ms) the creeps move by in each tick.
+
+            speed:
+                Creep speed, in px/ms
+
+            img_filenames, assets:
+                The creep images to pick from, and the
+                AssetManager to load them with.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.time_step = time_step
+        self.ticks = 0
+
+        # Time passed that is not yet simulated, in ms
+        #
+        self.lag = 0
+
+        for filename in img_filenames:
+            ROTATIONS.load(filename, assets.image(filename))
+        rotated = [[image for (image, w, h) in ROTATIONS.rotations(f)]
+                   for f in img_filenames]
+
+        width, height = screen_size
+        self.swarm = CreepSwarm(
+            screen_size,
+            self.rng.integers(0, [width + 1, height + 1], (n_creeps, 2)),
+            self.rng.choice([-1, 1], (n_creeps, 2)),
+            speed,
+            self.rng.integers(0, len(img_filenames), n_creeps),
+            rotated_sizes(rotated),
+            self.rng)
+        self.swarm.images = rotated
+
+    def time(self):
+        """ Simulated time, in ms.
+        """
+        return self.ticks * self.time_step
+
+    def step(self, ticks=1):
+        """ Move the creeps on by a number of ticks.
+        """
+        for tick in range(ticks):
+            self.swarm.update(self.time_step)
+        self.ticks += ticks
+
+    def advance(self, time_passed, max_ticks=10):
+        """ Catch the simulation up with time_passed (in ms) of
+            real time, in whole ticks, carrying over the rest.
+            At most max_ticks are taken, so that a slow frame
+            can't snowball.
+
+            Returns the number of ticks taken.
+        """
+        self.lag += time_passed
+        ticks = min(int(self.lag // self.time_step), max_ticks)
+        self.step(ticks)
+        self.lag = min(self.lag - ticks * self.time_step, self.time_step)
+        return ticks
+
+
+def _ordered_pairs(a, b):
+    """ Pairs of indices with the smaller first, sorted.
+    """
+    a, b = np.minimum(a, b), np.maximum(a, b)
+    order = np.lexsort((b, a))
+    return a[order], b[order]
+
+
+def blit_creeps(screen, creeps):
+    """ Blit a list of Creeps onto screen with a single blits
+        call, returning the rects drawn to.
+    """
+    return screen.blits([creep.blit_args() for creep in creeps])
+
+
+def draw_frame(screen, background, swarm, dirty_rects,
+               profiler=profiling.OFF):
+    """ Draw the swarm over the background, pushing only the
+        parts of the screen that changed to the display.
+
+            dirty_rects:
+                The rects the previous frame drew creeps to,
+                which are erased first.
+
+            profiler:
+                A profiling.Profiler to time the 'rasterize'
+                and 'flip' stages with.
+
+        Returns the rects drawn to, for the next frame.
+    """
+    # When the creeps cover much of the screen, erasing them
+    # one by one costs more than redrawing everything
+    #
+    width, height = screen.get_size()
+    dirty_area = sum(rect.w * rect.h for rect in dirty_rects)
+    if dirty_area > width * height / 2:
+        with profiler.stage('rasterize'):
+            screen.blit(background, (0, 0))
+            drawn_rects = swarm.draw(screen)
+        with profiler.stage('flip'):
+            pygame.display.flip()
+    else:
+        with profiler.stage('rasterize'):
+            screen.blits(
+                [(background, rect, rect) for rect in dirty_rects], False)
+            drawn_rects = swarm.draw(screen)
+        with profiler.stage('flip'):
+            pygame.display.update(dirty_rects + drawn_rects)
+    return drawn_rects
+
+
+def allocations(calls, ticks=10, warmup=2):
+    """ Memory allocated by ticks of calls (a list of callables,
+        such as the creeps' updates), as traced by tracemalloc
+        after warmup ticks.
+
+        Returns per tick on average:
+
+            'bytes':
+                Bytes the calls allocated and freed again before
+                returning (only the most in use at once within
+                each call is seen, so this is a lower bound).
+
+            'retained':
+                Bytes still allocated after the tick.  Objects
+                made before tracing started are not traced, so
+                replacing them reads as memory retained: start
+                tracemalloc before making the creeps to see only
+                what the calls keep.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+
+    # Warm up while tracing, so that the values the calls
+    # replace were traced when they were made
+    #
+    for tick in range(warmup):
+        for call in calls:
+            call()
+    gc.collect()
+
+    # What tracing a call that does nothing shows
+    #
+    def measure(call):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        call()
+        return tracemalloc.get_traced_memory()[1] - current
+    overhead = min(measure(lambda: None) for i in range(10))
+
+    start, _ = tracemalloc.get_traced_memory()
+    allocated = 0
+    for tick in range(ticks):
+        for call in calls:
+            allocated += max(measure(call) - overhead, 0)
+    end, _ = tracemalloc.get_traced_memory()
+    if not was_tracing:
+        tracemalloc.stop()
+
+    return {
+        'bytes': allocated / float(ticks),
+        'retained': (end - start) / float(ticks),
+    }
+
+
+def rotated_images(images):
+    """ Each image rotated the way Creep.update rotates it, for
+        each multiple of 45 degrees.
+    """
+    return [
+        [pygame.transform.rotate(image, -45 * octant)
+         for octant in range(8)]
+        for image in images]
+
+
+def rotated_sizes(rotated):
+    """ (images, 8, 2) array of the sizes of the rotated images.
+    """
+    return np.array([
+        [image.get_size() for image in row] for row in rotated])
+
+def run_game(seed=None):
     # Game parameters
     SCREEN_WIDTH, SCREEN_HEIGHT = 400, 400
     BG_COLOR = 150, 150, 80
-    CREEP_FILENAMES = [
-        'bluecreep.png',
-        'pinkcreep.png',
-        'graycreep.png']
     N_CREEPS = 20
 
     pygame.init()
     screen = pygame.display.set_mode(
                 (SCREEN_WIDTH, SCREEN_HEIGHT), 0, 32)
     clock = pygame.time.Clock()
+    ASSETS.preload(CREEP_FILENAMES)
+
+    background = pygame.Surface(screen.get_size())
+    background.fill(BG_COLOR)
+    screen.blit(background, (0, 0))
+    pygame.display.flip()
 
-    # Create N_CREEPS random creeps.
-    creeps = []
-    for i in range(N_CREEPS):
-        creeps.append(Creep(screen,
-                            choice(CREEP_FILENAMES),
-                            (   randint(0, SCREEN_WIDTH),
-                                randint(0, SCREEN_HEIGHT)),
-                            (   choice([-1, 1]),
-                                choice([-1, 1])),
-                            0.1))
+    # Create N_CREEPS random creeps, moved in steps of 20 ms
+    # whatever the frame rate.
+    sim = CreepSimulation(
+        (SCREEN_WIDTH, SCREEN_HEIGHT), N_CREEPS, seed, time_step=20)
+
+    # Where the creeps were drawn in the last frame
+    #
+    dirty_rects = []
+
+    # Times the stages of each frame, shown on screen
+    # once toggled with p
+    #
+    profiler = profiling.Profiler(fps=50)
 
     # The main game loop
     #
@@ -167,25 +785,38 @@ def run_game():
         # Limit frame speed to 50 FPS
         #
         time_passed = clock.tick(50)
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                exit_game()
-
-        # Redraw the background
-        screen.fill(BG_COLOR)
+        profiler.frame(time_passed)
+
+        with profiler.stage('events'):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    exit_game()
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_p:
+                        profiler.toggle()
+                    # Write out the stage timings
+                    elif event.key == pygame.K_o:
+                        profiler.dump('creeps-stages.json')
 
         # Update and redraw all creeps
-        for creep in creeps:
-            creep.update(time_passed)
-            creep.blitme()
+        with profiler.stage('update'):
+            sim.advance(time_passed)
+        dirty_rects = draw_frame(
+            screen, background, sim.swarm, dirty_rects, profiler)
 
-        pygame.display.flip()
+        # The overlay is erased with the creeps next frame
+        #
+        overlay = profiler.draw_overlay(screen)
+        if overlay is not None:
+            pygame.display.update(overlay)
+            dirty_rects.append(overlay)
 
 
 def exit_game():
+    print("Rotation cache: %(entries)d images, %(hits)d hits, "
+          "%(misses)d misses" % ROTATIONS.stats())
     sys.exit()
 
 if __name__ == '__main__':
-    run_game()
+    run_game(int(sys.argv[1]) if len(sys.argv) > 1 else None)
 
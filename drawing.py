@@ -1,6 +1,10 @@
+import math
+import weakref
+
 import geometry
 import pygame
 
+import numpy as np
 from numpy import array
 
 class Canvas(object):
@@ -13,6 +17,13 @@ class Canvas(object):
         self.rect = rect
         self.pxres = pxres
         self.origin = [self.rect.get_width()/2., self.rect.get_height()/2.]
+        # Bounding rects of everything drawn since the last clear
+        self.drawn_rects = []
+        # Simplifies long linesets to what can be seen at the current scale
+        self.lod = LevelOfDetail()
+        # Segments drawn and culled (for being off the canvas) by the last
+        # draw_lines or draw_index
+        self.cull_stats = {'drawn': 0, 'culled': 0}
 
     def get_coords(self):
         return self.coords
@@ -27,21 +38,93 @@ class Canvas(object):
         trans = array(self.get_coords().to_coords(x,rel))
         return trans*[1,-1]*self.pxres + self.origin
 
+    def world_per_pixel(self):
+        """Length in world coordinates of one pixel on the canvas"""
+        linear = self.get_coords().world_matrix()[:2,:2]
+        return 1./(self.pxres*math.sqrt(abs(np.linalg.det(linear))))
+
+    def view_state(self):
+        """Everything which decides where world coordinates land on the
+        canvas; if this is unchanged, so is the picture of an unchanged
+        model"""
+        return (
+            tuple(self.get_coords().world_matrix().ravel()),
+            tuple(self.origin),
+            self.pxres,
+            self.rect.get_size(),
+        )
+
     def clear_canvas(self):
+        self.drawn_rects = []
         return self.rect.fill([255]*3)
 
     def draw_lines(self,lines):
         """For a list consisting of lists of points, draw lines connecting the
         points in each list.  (Each list is a disjoint image)."""
-        for lineset in lines:
-            lineset = list([self.canvas_coords(line) for line in lineset])
-            pygame.draw.aalines(self.rect, [0]*3, False, lineset)
+        self.raster_lines(self.project_lines(lines, cull=True))
+        return self
+
+    def draw_index(self, index):
+        """Draw the linesets of a spatial.SegmentGrid, only looking at the
+        segments which are on the canvas"""
+        index = index.simplified(2.**self.lod.bucket(self))
+        found = index.query(*self.visible_world_rect())
+        self.cull_stats = {
+            'drawn': len(found), 'culled': len(index) - len(found)}
+        self.raster_lines(self.project_lines(index.runs(found), lod=False))
+        return self
+
+    def visible_world_rect(self):
+        """Corners (lowest, highest) of a rectangle in world coordinates which
+        covers the whole canvas"""
+        w, h = self.rect.get_size()
+        corners = self.canvas_coords([[0,0], [w,0], [0,h], [w,h]])
+        return corners.min(axis=0), corners.max(axis=0)
+
+    def project_lines(self, lines, lod=True, cull=False):
+        """Pixel positions of a list of linesets given in world coordinates.
+        All of the points are transformed together in a single call.  With
+        `lod`, long linesets are first simplified to the pixel size; with
+        `cull`, linesets entirely off the canvas are dropped."""
+        if lod:
+            lines = [self.lod.simplified(lineset, self) for lineset in lines]
+        pts, offsets = geometry.pack_linesets(lines)
+        if cull:
+            pts, offsets = self.cull(pts, offsets)
+        return geometry.unpack_linesets(self.world_coords(pts), offsets)
+
+    def cull(self, pts, offsets):
+        """Drop the packed linesets (see geometry.pack_linesets) whose
+        bounding boxes are entirely off the canvas"""
+        lengths = np.diff(offsets)
+        lengths = lengths[lengths > 0]
+        if not len(lengths):
+            self.cull_stats = {'drawn': 0, 'culled': 0}
+            return pts, offsets
+        starts = np.cumsum(lengths) - lengths
+        lo, hi = self.visible_world_rect()
+        visible = (np.maximum.reduceat(pts, starts) >= lo).all(axis=1) & \
+                  (np.minimum.reduceat(pts, starts) <= hi).all(axis=1)
+        segments = lengths - 1
+        self.cull_stats = {
+            'drawn': int(segments[visible].sum()),
+            'culled': int(segments[~visible].sum()),
+        }
+        offsets = np.concatenate([[0], np.cumsum(lengths[visible])])
+        return pts[np.repeat(visible, lengths)], offsets
+
+    def raster_lines(self, linesets):
+        """Draw linesets which are already in pixel coordinates"""
+        for lineset in linesets:
+            if len(lineset) > 1:
+                self.drawn_rects.append(
+                    pygame.draw.aalines(self.rect, [0]*3, False, lineset))
         return self
 
     def draw_points(self,pts):
-        for pt in pts:
-            pt = self.canvas_coords(pt)
-            pygame.draw.circle(self.rect, [0]*3, pt, radius=1)
+        for pt in self.world_coords(array(pts).reshape(-1,2)):
+            self.drawn_rects.append(
+                pygame.draw.circle(self.rect, [0]*3, pt, radius=1))
         return self
 
     def scale_to(self, pos=[0,0], scale_chg=0.1):
@@ -58,3 +141,243 @@ class Canvas(object):
         self.coords.scale = self.coords.scale*factor
         return self
 
+
+
+
+class LevelOfDetail(object):
+    """Simplified versions of long linesets, to within `pixels` of the
+    original on the canvas.  Tolerances are rounded down to a power of two
+    (a zoom bucket), and the simplified version of an array for each bucket
+    is cached for as long as the array is alive, so arrays must not be
+    changed in place once drawn."""
+    def __init__(self, pixels=0.5, min_points=64):
+        self.pixels = pixels
+        self.min_points = min_points
+        # id(lineset) -> (weakref to lineset, {bucket: simplified})
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def bucket(self, canvas):
+        return int(math.floor(math.log2(self.pixels*canvas.world_per_pixel())))
+
+    def simplified(self, lineset, canvas):
+        if len(lineset) < self.min_points:
+            return lineset
+        bucket = self.bucket(canvas)
+        if not isinstance(lineset, np.ndarray):
+            # Can't tell when a list changes, so don't cache it
+            return geometry.simplify(lineset, 2.**bucket)
+
+        entry = self.cache.get(id(lineset))
+        if entry is None or entry[0]() is not lineset:
+            if len(self.cache) > 1024:
+                self.cache = dict((k, v) for (k, v) in self.cache.items()
+                                  if v[0]() is not None)
+            entry = (weakref.ref(lineset), {})
+            self.cache[id(lineset)] = entry
+        versions = entry[1]
+        if bucket in versions:
+            self.hits += 1
+        else:
+            self.misses += 1
+            versions[bucket] = geometry.simplify(lineset, 2.**bucket)
+        return versions[bucket]
+
+
+class TraceLayer(object):
+    """A growing path (such as the pen trace) kept rasterized on its own
+    offscreen surface, which is composited under whatever else is drawn on
+    the canvas.  Each frame only the newly added segments are rasterized.
+    When the canvas view moves, the whole path is rasterized again.  This
+    happens in update() itself, but at most `budget` points per call (so
+    one chunk a frame), so a long path doesn't stall the UI.
+
+    The points may be in a frame turning about the world origin (such as
+    the paper on the disc): set `angle` to the world angle of that frame,
+    and the layer is rotated by it as it is composited.  The rotated image
+    is kept, and made again from the layer only when the angle changes;
+    until then new segments are rasterized straight onto it as well."""
+    def __init__(self, canvas, color=[0,0,255], budget=20000):
+        self.canvas = canvas
+        self.color = color
+        self.budget = budget
+        self.surface = pygame.Surface(canvas.rect.get_size(), pygame.SRCALPHA)
+        # World points of the path, in a buffer which grows by doubling
+        self.pts = np.zeros((1024,2))
+        self.size = 0
+        # How many of the points are rasterized, and for which view
+        self.drawn = 0
+        self.view = None
+        self.changed_rects = []
+        # Bounds of everything rasterized on the surface
+        self.bounds = None
+        # The frame of the points, and where the layer was last composited
+        # while turned
+        self.angle = 0.0
+        self.turned_rect = None
+        # The layer rotated by turned_angle, and the rects drawn on it
+        # since it was last composited
+        self.turned = None
+        self.turned_angle = None
+        self.turned_changes = []
+
+    def extend(self, pts):
+        """Add points to the end of the path"""
+        pts = np.asarray(pts, dtype=float).reshape(-1,2)
+        if self.size + len(pts) > len(self.pts):
+            capacity = max(2*len(self.pts), self.size + len(pts))
+            grown = np.zeros((capacity,2))
+            grown[:self.size] = self.pts[:self.size]
+            self.pts = grown
+        self.pts[self.size:self.size+len(pts)] = pts
+        self.size += len(pts)
+        return self
+
+    def clear(self):
+        """Forget the whole path"""
+        self.size = 0
+        self.drawn = 0
+        self.surface.fill([0,0,0,0])
+        self.bounds = None
+        self.turned = None
+        # The old path has to be erased from the display too
+        self.changed_rects = [self.surface.get_rect()]
+        return self
+
+    def pending(self):
+        """Number of points not yet rasterized"""
+        return self.size - self.drawn
+
+    def update(self):
+        """Rasterize the next (at most `budget`) points which aren't on the
+        surface yet, starting over if the view moved"""
+        view = self.canvas.view_state()
+        if view != self.view:
+            self.surface.fill([0,0,0,0])
+            self.bounds = None
+            self.turned = None
+            self.drawn = 0
+            self.view = view
+        if self.pending() == 0:
+            return self
+        # Start from the last point drawn, to join up with it
+        start = max(self.drawn - 1, 0)
+        stop = min(self.size, start + self.budget)
+        if stop - start > 1:
+            pts = geometry.simplify(
+                self.pts[start:stop],
+                self.canvas.lod.pixels*self.canvas.world_per_pixel())
+            pixels = self.canvas.world_coords(pts)
+            rect = pygame.draw.aalines(self.surface, self.color, False, pixels)
+            self.changed_rects.append(rect)
+            if self.bounds is None or not self.bounds.contains(rect):
+                # Outside the rotated image, which has to be made again
+                self.turned = None
+            self.bounds = rect if self.bounds is None else self.bounds.union(rect)
+            if self.turned is not None and self.angle == self.turned_angle:
+                self.turned_changes.append(self.draw_on_turned(pixels))
+        self.drawn = stop
+        return self
+
+    def draw(self):
+        """Composite the layer onto the canvas, turned by `angle`"""
+        if self.angle == 0 and self.turned_rect is None:
+            self.canvas.rect.blit(self.surface, (0,0))
+            # Only the newly rasterized parts differ from the last frame
+            self.canvas.drawn_rects += self.changed_rects
+        else:
+            self.draw_turned()
+        self.changed_rects = []
+        return self
+
+    def pivot(self):
+        """Pixel position of the world origin, which the layer turns about"""
+        return pygame.math.Vector2(*self.canvas.world_coords([0,0]))
+
+    def draw_on_turned(self, pixels):
+        """Rasterize `pixels` (on the layer) onto the rotated image too,
+        returning the rect drawn to on the canvas"""
+        theta = math.radians(-self.turned_angle)
+        c, s = math.cos(theta), math.sin(theta)
+        pivot = np.array(self.pivot())
+        d = np.asarray(pixels) - pivot
+        turned = pivot + np.stack([c*d[:,0] - s*d[:,1],
+                                   s*d[:,0] + c*d[:,1]], axis=-1)
+        rect = pygame.draw.aalines(self.turned, self.color, False,
+                                   turned - self.turned_rect.topleft)
+        return rect.move(self.turned_rect.topleft)
+
+    def draw_turned(self):
+        """Composite the rasterized part of the layer rotated by `angle`
+        about the world origin.  If the angle changed (or the path grew
+        past the rotated image), everywhere it was or is now drawn has
+        changed; otherwise just the segments drawn since last time."""
+        if self.bounds is None:
+            self.turned = None
+        elif self.turned is not None and self.angle == self.turned_angle:
+            self.canvas.rect.blit(self.turned, self.turned_rect)
+            self.canvas.drawn_rects += self.turned_changes
+            self.turned_changes = []
+            return
+        old_rect = self.turned_rect
+        self.turned_rect = None
+        if self.bounds is not None:
+            # Always rotate the layer itself, never an earlier rotation,
+            # so the image doesn't blur as the angle keeps changing
+            self.turned = pygame.transform.rotate(
+                self.surface.subsurface(self.bounds), self.angle)
+            self.turned_angle = self.angle
+            # Turn the center of the bounds about the origin's pixel
+            pivot = self.pivot()
+            center = pivot + (self.bounds.center - pivot).rotate(-self.angle)
+            self.turned_rect = self.turned.get_rect(center=(center.x, center.y))
+            self.canvas.rect.blit(self.turned, self.turned_rect)
+        self.turned_changes = []
+        self.canvas.drawn_rects += [
+            r for r in [old_rect, self.turned_rect] if r is not None]
+        if self.angle == 0:
+            self.turned = None
+            self.turned_rect = None
+
+
+class RenderScheduler(object):
+    """Decides which frames need drawing at all, and which parts of the
+    display need pushing, by remembering what the last frame showed."""
+    def __init__(self):
+        self.rendered = 0
+        self.skipped = 0
+        self.state = None
+        self.view = None
+        self.rects = []
+
+    def invalidate(self):
+        """Force the next frame to be drawn and pushed in full"""
+        self.state = None
+        self.view = None
+
+    def needs_render(self, canvas, state):
+        """Whether a frame showing the model `state` on `canvas` differs from
+        the last one presented"""
+        if self.view is not None and state == self.state \
+           and canvas.view_state() == self.view:
+            self.skipped += 1
+            return False
+        return True
+
+    def present(self, canvas, state):
+        """Push the frame just drawn on `canvas` to the display.  If only the
+        model changed, this is just the areas drawn in this frame or the last
+        one; if the view moved, it is everything."""
+        view = canvas.view_state()
+        if view != self.view:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.rects + canvas.drawn_rects)
+        self.rects = list(canvas.drawn_rects)
+        self.state = state
+        self.view = view
+        self.rendered += 1
+
+    def stats(self):
+        return {'rendered': self.rendered, 'skipped': self.skipped}
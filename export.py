@@ -0,0 +1,166 @@
+"""Vector export of drawings for a plotter, as SVG or G-code.
+
+A drawing is a list of paths.  Each path is either a lineset (an array-like of
+points, such as those in the list MechanismDrawing.draw_mechanism returns) or
+an iterator of (n,2) chunks of one long path (such as tracing.trace yields).
+Points are mapped to plotter coordinates (millimetres, y up) through a
+geometry.CoordinateSystem and written out a chunk at a time, so traces of
+millions of points are exported in constant memory.
+"""
+import numpy as np
+
+import geometry
+import travel
+
+
+def chunks_of(path):
+    """The chunks of points making up a path"""
+    if isinstance(path, (np.ndarray, list, tuple)):
+        yield np.asarray(path, dtype=float).reshape(-1,2)
+    else:
+        for chunk in path:
+            yield np.asarray(chunk, dtype=float).reshape(-1,2)
+
+def order_paths(paths, start=[0,0]):
+    """Reorder (and reverse where shorter) linesets to cut down pen-up travel
+    from `start` (see travel.optimize).  Paths which are iterators of chunks
+    can't be looked ahead of, so a list holding any is returned as is."""
+    if not all(isinstance(p, (np.ndarray, list, tuple)) for p in paths):
+        return paths
+    paths = [np.asarray(p, dtype=float).reshape(-1,2) for p in paths]
+    ordered, report = travel.optimize([p for p in paths if len(p)], start)
+    return ordered
+
+def _format(template, pts):
+    """Format each point of `pts` with the template, all in one go"""
+    return (template*len(pts)) % tuple(np.ravel(pts))
+
+
+
+class PlotWriter(object):
+    """Streams paths to a file object, keeping count of what it wrote.
+    Subclasses say how to start a path, continue it and finish the file."""
+    def __init__(self, f, coords=None, optimize=True):
+        self.f = f
+        self.coords = coords or geometry.CoordinateSystem()
+        self.optimize = optimize
+        self.paths = 0
+        self.points = 0
+        self.pen_up_distance = 0.0
+        self.position = np.zeros(2)
+
+    def write(self, paths):
+        """Write all of the paths, returning the writer's statistics"""
+        self.begin()
+        if self.optimize:
+            # Plan from the plotter origin, in drawing coordinates
+            paths = order_paths(paths, self.coords.from_coords(self.position))
+        for path in paths:
+            first = True
+            for chunk in chunks_of(path):
+                if not len(chunk):
+                    continue
+                chunk = self.coords.to_coords(chunk)
+                if first:
+                    self.pen_up_distance += np.hypot(*(chunk[0] - self.position))
+                    self.move_to(chunk[0])
+                    self.line_to(chunk[1:])
+                    self.paths += 1
+                    first = False
+                else:
+                    self.line_to(chunk)
+                self.points += len(chunk)
+                self.position = chunk[-1]
+            if not first:
+                self.end_path()
+        self.end()
+        return self.stats()
+
+    def stats(self):
+        return {
+            'paths': self.paths,
+            'points': self.points,
+            'pen_up_distance': float(self.pen_up_distance),
+        }
+
+    def begin(self): pass
+    def end(self): pass
+    def move_to(self, pt): pass
+    def line_to(self, pts): pass
+    def end_path(self): pass
+
+
+class SVGWriter(PlotWriter):
+    """Writes one <path> per path on a page of `size` millimetres.  Plotter
+    coordinates have y up from the bottom of the page, so are flipped."""
+    def __init__(self, f, coords=None, optimize=True, size=(210,297),
+                 stroke_width=0.3):
+        PlotWriter.__init__(self, f, coords, optimize)
+        self.size = size
+        self.stroke_width = stroke_width
+
+    def flip(self, pts):
+        return np.asarray(pts)*[1,-1] + [0, self.size[1]]
+
+    def begin(self):
+        w, h = self.size
+        self.f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<svg xmlns="http://www.w3.org/2000/svg" '
+            'width="%gmm" height="%gmm" viewBox="0 0 %g %g">\n'
+            '<g fill="none" stroke="black" stroke-width="%g" '
+            'stroke-linecap="round" stroke-linejoin="round">\n' %
+            (w, h, w, h, self.stroke_width))
+
+    def move_to(self, pt):
+        self.f.write('<path d="M%.3f,%.3f' % tuple(self.flip(pt)))
+
+    def line_to(self, pts):
+        if len(pts):
+            self.f.write(_format(' %.3f,%.3f', self.flip(pts)))
+
+    def end_path(self):
+        self.f.write('"/>\n')
+
+    def end(self):
+        self.f.write('</g>\n</svg>\n')
+
+
+
+class GCodeWriter(PlotWriter):
+    """Writes G-code for a pen plotter: rapid moves with the pen up between
+    paths, feed moves with it down along them"""
+    def __init__(self, f, coords=None, optimize=True, feed_rate=3000,
+                 pen_up="M5", pen_down="M3"):
+        PlotWriter.__init__(self, f, coords, optimize)
+        self.feed_rate = feed_rate
+        self.pen_up = pen_up
+        self.pen_down = pen_down
+
+    def begin(self):
+        # millimetres, absolute positions
+        self.f.write("G21\nG90\n%s\n" % self.pen_up)
+
+    def move_to(self, pt):
+        self.f.write("G0 X%.3f Y%.3f\n%s\nG1 F%g\n" % (
+            pt[0], pt[1], self.pen_down, self.feed_rate))
+
+    def line_to(self, pts):
+        if len(pts):
+            self.f.write(_format("G1 X%.3f Y%.3f\n", pts))
+
+    def end_path(self):
+        self.f.write("%s\n" % self.pen_up)
+
+    def end(self):
+        self.f.write("G0 X0 Y0\n")
+
+
+
+def write_svg(paths, f, **kwargs):
+    """Write the paths to the file object `f` as SVG (see SVGWriter)"""
+    return SVGWriter(f, **kwargs).write(paths)
+
+def write_gcode(paths, f, **kwargs):
+    """Write the paths to the file object `f` as G-code (see GCodeWriter)"""
+    return GCodeWriter(f, **kwargs).write(paths)
@@ -5,6 +5,8 @@ import numpy as np
 import drawing
 import geometry
 import mechanism
+import profiling
+import tracing
 
 from utilities import ziplist
 
@@ -18,6 +20,8 @@ from utilities import ziplist
 def run():
     # Game parameters
     SCREEN_WIDTH, SCREEN_HEIGHT = 600, 600
+    # Speeds of the disc and the arm while tracing (degrees per second)
+    DISC_SPEED, ARM_SPEED = 90, 37
 
     pygame.init()
     screen = pygame.display.set_mode(
@@ -28,18 +32,29 @@ def run():
     model = mechanism.MechanismModel()
     mech = mechanism.MechanismDrawing(model)
     canvas = drawing.Canvas(screen, scale=0.7)
+    scheduler = drawing.RenderScheduler()
 
-    # The main game loop
-    #
-    while True:
-        # Limit frame speed to 50 FPS
-        #
-        time_passed = clock.tick(50)
+    # The path drawn by the pen, on the paper of the disc
+    trace = drawing.TraceLayer(canvas)
+    tracing_on = False
+
+    # World points marked on the canvas, redrawn every frame
+    points = []
+
+    # Timers for each stage of a frame (off until toggled with p)
+    profiler = profiling.Profiler(fps=50)
 
+    def handle_events(tracing_on):
+        """Act on the input since the last frame, returning whether the
+        mechanism is now tracing"""
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 exit_game()
 
+            # The window contents were lost, so redraw them
+            elif event.type in [pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED]:
+                scheduler.invalidate()
+
             # Keypresses
             elif event.type == pygame.KEYDOWN:
 
@@ -55,7 +70,35 @@ def run():
                 # Coords
                 elif event.key == pygame.K_v:
                     print("placing coords")
-                    canvas.draw_points([[0,0]])
+                    points.append([0,0])
+
+                # Turn the mechanism and trace its path
+                elif event.key == pygame.K_t:
+                    tracing_on = not tracing_on
+
+                # Forget the trace
+                elif event.key == pygame.K_x:
+                    trace.clear()
+
+                # Frame statistics
+                elif event.key == pygame.K_f:
+                    print("frames: " + str(scheduler.stats()))
+
+                # Time the stages of each frame, showing them on screen
+                elif event.key == pygame.K_p:
+                    profiler.toggle()
+                    scheduler.invalidate()
+
+                # Record every call with cProfile until pressed again, then
+                # write out the calls and the stage timings
+                elif event.key == pygame.K_o:
+                    if profiler.cprofile is None:
+                        print("profiling")
+                        profiler.start_cprofile()
+                    else:
+                        profiler.stop_cprofile('game.prof')
+                        profiler.dump('game-stages.json')
+                        print("wrote game.prof and game-stages.json")
  
             # Pan with middle-click
             elif event.type == pygame.MOUSEMOTION:
@@ -100,12 +143,48 @@ def run():
                        not pressed[pygame.K_l] and \
                        not pressed[pygame.K_r]:
                         canvas.scale_to(pos, (diff/50.))
+        return tracing_on
 
-        # Redraw the mechanism
-        canvas.clear_canvas()
-        canvas.draw_lines(mech.draw_mechanism())
-
-        pygame.display.flip()
+    # The main game loop
+    #
+    while True:
+        # Limit frame speed to 50 FPS
+        #
+        time_passed = clock.tick(50)
+        profiler.frame(time_passed)
+
+        with profiler.stage('events'):
+            tracing_on = handle_events(tracing_on)
+
+        with profiler.stage('update'):
+            if tracing_on:
+                model.disc_angle += DISC_SPEED*time_passed/1000.
+                model.arm_angle += ARM_SPEED*time_passed/1000.
+                trace.extend(tracing.pen_positions(
+                    model.disc_angle, model.arm_angle,
+                    model.arm_length, model.disc_radius, mech))
+            # The trace is on the paper, which turns with the disc
+            trace.angle = mech.disc_angle_direction*model.disc_angle
+
+        # Redraw the mechanism, unless nothing about it changed (the
+        # profiler overlay is redrawn every frame while it is shown)
+        state = (model.state(), trace.size, trace.drawn, len(points))
+        if profiler.overlay or scheduler.needs_render(canvas, state):
+            canvas.clear_canvas()
+            with profiler.stage('geometry'):
+                lines = mech.draw_mechanism()
+            with profiler.stage('transform'):
+                pixels = canvas.project_lines(lines, cull=True)
+            with profiler.stage('rasterize'):
+                trace.update().draw()
+                canvas.raster_lines(pixels)
+                if points:
+                    canvas.draw_points(points)
+            overlay = profiler.draw_overlay(screen)
+            if overlay is not None:
+                canvas.drawn_rects.append(overlay)
+            with profiler.stage('flip'):
+                scheduler.present(canvas, state)
 
 
 def exit_game():
@@ -1,38 +1,156 @@
 import numpy as np
 import pdb
 
+from functools import lru_cache
+
 def scale(value, target_scale = 1.0, source_scale = 1.0):
     return target_scale/source_scale * value
 
 def rot2d(angle, vectors, about=[0,0]):
     """ Rotates a vector (or group of vectors) about a point by a given angle
     (in degrees)"""
-    vs = np.array(vectors) - about
+    vs = np.asarray(vectors, dtype=float) - about
+    return about + vs @ rotation_matrix(angle).T
+
+def rotation_matrix(angle):
+    """2x2 matrix rotating counter-clockwise by `angle` degrees"""
     angle_rad = np.radians(angle)
     c = np.cos(angle_rad)
     s = np.sin(angle_rad)
-    R = np.array([[c, -s],[s, c]])
-    return about + np.array([np.dot(R,v) for v in vs])
+    return np.array([[c, -s],[s, c]])
+
+def affine_matrix(offset=[0,0], angle=0, scale=1.0):
+    """Homogeneous 3x3 matrix which rotates by `angle` degrees, scales by
+    `scale` and then translates by `offset` (the order used by `transform`)"""
+    M = np.identity(3)
+    M[:2,:2] = scale*rotation_matrix(angle)
+    M[:2,2] = offset
+    return M
+
+def apply_affine(M, vectors, rel=False):
+    """Apply the homogeneous 3x3 matrix `M` to an array of vectors of shape
+    (2,), (N,2) or (...,N,2) in a single matrix multiply.  If `rel` is set the
+    vectors are displacements, so the translation part of `M` is ignored."""
+    vectors = np.asarray(vectors, dtype=float)
+    out = vectors @ M[:2,:2].T
+    if not rel:
+        out += M[:2,2]
+    return out
 
 def transform(vectors, offset=[0,0], angle=0, scale=1.0):
-    vectors = np.array(vectors)
-    one = (len(vectors.shape)==1)
-    if one: vectors = np.array([vectors])
-    rotated = scale*rot2d(angle,vectors)
-    transformed = offset + rotated
-    # If requested, return a single vector
-    if one:
-        return transformed[0]
-    else:
-        return transformed
+    # A single vector in gives a single vector out; (N,2) or (...,N,2) in
+    # gives the same shape back
+    return apply_affine(affine_matrix(offset, angle, scale), vectors)
+
+def batch_transform(vectors, offset=[0,0], angle=0, scale=1.0):
+    """`transform` with its own offset, angle and scale for each of a stack of
+    configurations: `angle` and `scale` have shape (...), `offset` has shape
+    (...,2), and `vectors` is either (N,2), shared by every configuration, or
+    (...,N,2).  Returns an array of shape (...,N,2)."""
+    vectors = np.asarray(vectors, dtype=float)
+    angle_rad = np.radians(angle)[...,None]
+    scale = np.asarray(scale, dtype=float)[...,None]
+    offset = np.asarray(offset, dtype=float)
+    c = scale*np.cos(angle_rad)
+    s = scale*np.sin(angle_rad)
+    x = vectors[...,0]
+    y = vectors[...,1]
+    return np.stack([
+        c*x - s*y + offset[...,None,0],
+        s*x + c*y + offset[...,None,1],
+    ], axis=-1)
+
+@lru_cache(maxsize=64)
+def unit_circle(resolution=20, start=0, end=360):
+    """Read-only template of `resolution` points on the unit circle, going
+    from `start` to `end` degrees"""
+    th = np.radians(np.linspace(start, end, resolution))
+    pts = np.stack([np.cos(th), np.sin(th)], axis=-1)
+    pts.flags.writeable = False
+    return pts
+
+@lru_cache(maxsize=64)
+def unit_ticks(resolution=12, start=0, end=360):
+    """Read-only template of `resolution` unit directions, going from `start`
+    to `end` degrees, where angle 0 points up (as in `radial_line`)"""
+    th = np.radians(np.linspace(start, end, resolution))
+    dirs = np.stack([-np.sin(th), np.cos(th)], axis=-1)
+    dirs.flags.writeable = False
+    return dirs
+
+def template_cache_info():
+    """Hit/miss counters of the circle and tick templates"""
+    return {
+        'circle': unit_circle.cache_info(),
+        'ticks': unit_ticks.cache_info(),
+    }
 
 def circle(radius, center=[0,0], start=0, end=360, resolution=20):
-    pts = [rot2d(th, [[1,0]])[0] for th in np.linspace(start, end, resolution)]
-    return transform(pts, offset=center, scale=radius)
+    return transform(unit_circle(resolution, start, end),
+                     offset=center, scale=radius)
 
 def radial_line(r0, r1, center=[0,0], angle=0):
     return transform([[0,r0], [0,r1]], offset=center, angle=angle)
 
+def radial_lines(r0, r1, center=[0,0], start=0, end=360, resolution=12):
+    """Array of shape (resolution,2,2) holding the radial lines from `r0` to
+    `r1` at evenly spaced angles (equivalent to calling `radial_line` at each
+    angle of np.linspace(start, end, resolution))"""
+    dirs = unit_ticks(resolution, start, end)
+    return np.asarray(center) + dirs[:,None,:]*np.array([r0, r1])[:,None]
+
+def pack_linesets(lines):
+    """Concatenate a list of linesets (lists of points) into one contiguous
+    (N,2) array.  Returns the array and the offsets at which each lineset
+    starts, with the total length appended."""
+    lines = [np.asarray(lineset, dtype=float).reshape(-1,2) for lineset in lines]
+    offsets = np.zeros(len(lines)+1, dtype=int)
+    offsets[1:] = np.cumsum([len(lineset) for lineset in lines])
+    if not lines:
+        return np.zeros((0,2)), offsets
+    return np.concatenate(lines), offsets
+
+def unpack_linesets(pts, offsets):
+    """Inverse of `pack_linesets`: split `pts` back into a list of linesets"""
+    return np.split(pts, offsets[1:-1])
+
+
+def simplify(pts, tolerance):
+    """Simplify a polyline so that it stays within `tolerance` of the
+    original, keeping its end points (Douglas-Peucker, after dropping runs
+    of points which fall into the same tolerance-sized grid cell)"""
+    pts = np.asarray(pts, dtype=float)
+    if len(pts) < 3 or tolerance <= 0:
+        return pts
+
+    # Cheap vectorized first pass; the grid cells have a diagonal of half the
+    # tolerance, so what it drops is that close to a point it keeps
+    cells = np.floor(pts/(tolerance/np.sqrt(8)))
+    keep = np.ones(len(pts), dtype=bool)
+    keep[1:-1] = (cells[1:-1] != cells[:-2]).any(axis=1)
+    pts = pts[keep]
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts)-1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        d = pts[j] - pts[i]
+        rel = pts[i+1:j] - pts[i]
+        length = np.hypot(d[0], d[1])
+        if length == 0:
+            dist = np.hypot(rel[:,0], rel[:,1])
+        else:
+            dist = np.abs(d[0]*rel[:,1] - d[1]*rel[:,0])/length
+        k = np.argmax(dist)
+        if dist[k] > tolerance/2.:
+            k += i + 1
+            keep[k] = True
+            stack += [(i, k), (k, j)]
+    return pts[keep]
+
 
 
 ###########
@@ -41,60 +159,77 @@ def radial_line(r0, r1, center=[0,0], angle=0):
 
 class CoordinateSystem(object):
     def __init__(self, scale=1.0, origin=[0,0], angle=0.0, parent=None):
-        self.scale = scale
-        self.origin = np.array(origin)
-        self.angle = angle
+        self._world = None
+        self._inverse = None
         self.children = []
         self.parent = None
+        self.scale = scale
+        self.origin = origin
+        self.angle = angle
         if parent: self.parent_to(parent)
 
+    def __setattr__(self, name, value):
+        # Changing our placement moves us and every descendant.  (Note that
+        # `origin += ...` also goes through here.)  The origin is copied, so
+        # that changing the array it was set from doesn't move us unseen;
+        # writing to one element of it (`origin[0] = ...`) isn't seen either,
+        # so set the whole origin instead (or call invalidate afterwards).
+        if name == 'origin':
+            value = np.array(value, dtype=float)
+        object.__setattr__(self, name, value)
+        if name in ('scale', 'origin', 'angle'):
+            self.invalidate()
+
+    def invalidate(self):
+        """Drop the cached world matrices of this system and its children"""
+        if self._world is None and self._inverse is None:
+            return
+        self._world = None
+        self._inverse = None
+        for child in self.children:
+            child.invalidate()
+
     def parent_to(self, parent):
         if self.parent is not None:
-            self.parent.remove(self)
+            self.parent.children.remove(self)
         self.parent = parent
         self.parent.add_children(self)
+        self.invalidate()
 
     def add_children(self, *children):
         self.children += children
 
+    def local_matrix(self):
+        """Homogeneous matrix taking system coords to parent coords"""
+        return affine_matrix(self.origin, self.angle, self.scale)
+
+    def world_matrix(self):
+        """Homogeneous matrix taking system coords to world coords"""
+        if self._world is None:
+            M = self.local_matrix()
+            if self.parent is not None:
+                M = self.parent.world_matrix() @ M
+            self._world = M
+        return self._world
+
+    def inverse_matrix(self):
+        """Homogeneous matrix taking world coords to system coords"""
+        if self._inverse is None:
+            self._inverse = np.linalg.inv(self.world_matrix())
+        return self._inverse
+
     def to_coords(self, x, rel=False):
         """Coordinates of the system in world coordinates"""
-        if self.parent is None:
-            return self._to_coords(x, rel)
-        else:
-            return self.parent.to_coords(self._to_coords(x,rel),rel)
+        return apply_affine(self.world_matrix(), x, rel)
 
     def from_coords(self, x, rel=False):
         """Coordinates of the world in system coordinates"""
-        if self.parent is None:
-            return self._from_coords(x, rel)
-        else:
-            return self.from_coords(self.parent._from_coords(x,rel),rel)
+        return apply_affine(self.inverse_matrix(), x, rel)
 
     def _to_coords(self, x, rel=False):
-        x = np.array(x)
-        if rel:
-            our_offset = 0
-        else:
-            our_offset = self.origin
-        return transform(
-            x,
-            offset=our_offset,
-            scale=self.scale,
-            angle=self.angle,
-        )
+        """Coordinates of the system in parent coords"""
+        return apply_affine(self.local_matrix(), x, rel)
 
     def _from_coords(self, x, rel=False):
-        """Coordinates of the world in system coords"""
-        x = np.array(x)
-        if rel:
-            our_offset = 0
-        else:
-            our_offset = -self.origin/self.scale
-        return transform(
-            x,
-            offset=our_offset,
-            angle=-self.angle,
-            scale=1/self.scale,
-        )
-
+        """Coordinates of the parent in system coords"""
+        return apply_affine(np.linalg.inv(self.local_matrix()), x, rel)
@@ -0,0 +1,114 @@
+"""Offscreen rendering of the mechanism, for benchmarking in CI or on a
+server without a display.
+
+`python headless.py --json frames.json` sweeps the arm and disc angles at a
+few resolutions and writes per-stage frame-time percentiles to frames.json.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+import pygame
+
+import drawing
+import mechanism
+from profiling import percentiles
+
+STAGES = ['geometry', 'transform', 'rasterize', 'total']
+
+
+def init():
+    """Initialise pygame without opening a window"""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+
+
+
+class OffscreenRenderer(object):
+    """Draws a MechanismDrawing through a drawing.Canvas onto an offscreen
+    pygame Surface"""
+    def __init__(self, size=(600,600), model=None, scale=None):
+        # By default, show as much of the mechanism as game.run does
+        if scale is None: scale = 0.7*min(size)/600.
+        self.model = model or mechanism.MechanismModel()
+        self.mech = mechanism.MechanismDrawing(self.model)
+        self.surface = pygame.Surface(size)
+        self.canvas = drawing.Canvas(self.surface, scale=scale)
+
+    def render(self, timings=None):
+        """Draw one frame, returning the surface.  If `timings` is given it
+        maps each of STAGES to a list, which gets this frame's durations."""
+        t0 = time.perf_counter()
+        lines = self.mech.draw_mechanism()
+        t1 = time.perf_counter()
+        pixels = self.canvas.project_lines(lines, cull=True)
+        t2 = time.perf_counter()
+        self.canvas.clear_canvas()
+        self.canvas.raster_lines(pixels)
+        t3 = time.perf_counter()
+        if timings is not None:
+            timings['geometry'].append(t1 - t0)
+            timings['transform'].append(t2 - t1)
+            timings['rasterize'].append(t3 - t2)
+            timings['total'].append(t3 - t0)
+        return self.surface
+
+
+
+def frame_benchmark(resolutions=[(300,300), (600,600), (1200,1200)],
+                    steps=30):
+    """Render a sweep of steps x steps arm/disc angles at each resolution,
+    returning the per-stage frame-time percentiles for each"""
+    results = []
+    for size in resolutions:
+        renderer = OffscreenRenderer(size)
+        timings = dict((stage, []) for stage in STAGES)
+        angles = np.linspace(0, 360, steps, endpoint=False)
+        for disc_angle, arm_angle in itertools.product(angles, angles):
+            renderer.model.disc_angle = disc_angle
+            renderer.model.arm_angle = arm_angle
+            renderer.render(timings)
+        results.append({
+            'resolution': list(size),
+            'frames': steps*steps,
+            'stages': dict(
+                (stage, percentiles(timings[stage])) for stage in STAGES),
+        })
+    return results
+
+def print_results(results):
+    for result in results:
+        print("%dx%d, %d frames" % (
+            result['resolution'][0], result['resolution'][1],
+            result['frames']))
+        for stage in STAGES:
+            print("  %-10s p50 %7.3f ms  p95 %7.3f ms  p99 %7.3f ms" % (
+                (stage,) + tuple(result['stages'][stage][p]
+                                 for p in ['p50', 'p95', 'p99'])))
+
+
+
+###############
+# ENTRY POINT #
+###############
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--steps', type=int, default=30,
+                        help="angles swept per joint")
+    args = parser.parse_args()
+
+    init()
+    results = frame_benchmark(steps=args.steps)
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'frame_times': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
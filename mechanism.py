@@ -1,5 +1,9 @@
 import numpy as np
-from geometry import transform, scale, radial_line, circle
+from collections import namedtuple
+
+from geometry import transform, scale, batch_transform
+from geometry import unit_circle, unit_ticks
+from geometry import pack_linesets, unpack_linesets
 
 class MechanismModel(object):
     def __init__(self, disc_radius=5, arm_length=7):
@@ -16,6 +20,65 @@ class MechanismModel(object):
     def get_disc_angle(self): return self.disc_angle
     def get_arm_angle(self): return self.arm_angle
 
+    def state(self):
+        """Every parameter of the model, as a comparable tuple"""
+        return (self.disc_radius, self.arm_length,
+                self.disc_angle, self.arm_angle)
+
+
+
+# points in the arm head
+# (converted to local coords from greg's VB code
+ARM_HEAD_PTS = np.array([
+    [-0.04971916,  0.94869806-1],
+    [-0.06975647,  0.99756405-1],
+    [-0.05390603,  1.02858842-1],
+    [-0.02722403,  1.03964362-1],
+    [-0.04361939,  0.99904822-1],
+    [-0.03046844,  0.96952136-1],
+    [ 0.        ,  0.96      -1],
+    [ 0.03046844,  0.96952136-1],
+    [ 0.04361939,  0.99904822-1],
+    [ 0.02722403,  1.03964362-1],
+    [ 0.05390603,  1.02858842-1],
+    [ 0.06975647,  0.99756405-1],
+    [ 0.04971916,  0.94869806-1],
+])
+
+
+
+class SceneNode(object):
+    """A retained part of a drawing: linesets built in local coordinates,
+    plus the offset and angle placing them in the world.  The local geometry
+    is only rebuilt when the arguments it was built from change, and the
+    placed geometry only when either half changes.  The output linesets
+    are read-only, as they are shared from frame to frame."""
+    def __init__(self, shape):
+        # shape(*shape_args) gives a list of linesets in local coords
+        self.shape = shape
+        self.shape_args = None
+        self.pose = None
+        self.local = None
+        self.output = None
+        # Bumped whenever the output changes
+        self.generation = 0
+
+    def update(self, shape_args, offset, angle):
+        """Bring the node up to date, returning True if its output changed"""
+        pose = (tuple(offset), angle)
+        if shape_args != self.shape_args:
+            self.local = pack_linesets(self.shape(*shape_args))
+            self.shape_args = shape_args
+        elif pose == self.pose:
+            return False
+        pts, offsets = self.local
+        placed = transform(pts, offset=offset, angle=angle)
+        placed.flags.writeable = False
+        self.output = unpack_linesets(placed, offsets)
+        self.pose = pose
+        self.generation += 1
+        return True
+
 
 
 class MechanismDrawing(object):
@@ -33,85 +96,151 @@ class MechanismDrawing(object):
         # increasing disc angle increases angle in mechanism coords
         self.disc_angle_direction = -1
 
+        # Retained geometry, only recomputed when the model changes
+        self.arm = SceneNode(self.arm_shape)
+        self.disc = SceneNode(self.disc_shape)
+        self.drawn = None
+        # Generations of the arm and disc in self.drawn
+        self.drawn_generations = None
+
     def draw_mechanism(self):
-        parts = [
-            self.draw_arm(),
-            self.draw_disc(),
-        ]
-        return sum(parts, [])
+        """Linesets of the whole mechanism, as a tuple (which is reused
+        until the arm or the disc moves)"""
+        self.update_arm()
+        self.update_disc()
+        # The nodes may also have been updated by draw_arm or draw_disc
+        generations = (self.arm.generation, self.disc.generation)
+        if generations != self.drawn_generations:
+            self.drawn = tuple(self.arm.output + self.disc.output)
+            self.drawn_generations = generations
+        return self.drawn
 
     def draw_arm(self):
-        base_radius = self.model.get_disc_radius()/10.
+        self.update_arm()
+        return self.arm.output
 
+    def draw_disc(self):
+        self.update_disc()
+        return self.disc.output
+
+    def update_arm(self):
         # offset between center of disc and pivot of arm
         arm_offset = [0, -self.model.get_arm_length()]
 
-        # points in the arm head
-        # (converted to local coords from greg's VB code
-        head_pts = [
-            [-0.04971916,  0.94869806-1],
-            [-0.06975647,  0.99756405-1],
-            [-0.05390603,  1.02858842-1],
-            [-0.02722403,  1.03964362-1],
-            [-0.04361939,  0.99904822-1],
-            [-0.03046844,  0.96952136-1],
-            [ 0.        ,  0.96      -1],
-            [ 0.03046844,  0.96952136-1],
-            [ 0.04361939,  0.99904822-1],
-            [ 0.02722403,  1.03964362-1],
-            [ 0.05390603,  1.02858842-1],
-            [ 0.06975647,  0.99756405-1],
-            [ 0.04971916,  0.94869806-1],
-        ]
-        # scale the points in the head to match the base, and put the head into
-        # the center of the disk
-        head_pts = transform(
-            head_pts, 
-            offset=[0, self.model.get_arm_length()],
-            scale=10*base_radius
-        ).tolist()
-
-        # points that make up a vertical arm
-        pts = [ 
-            # "base"
-            circle(base_radius, end=-180),
-            # line across base
-            [[-base_radius,0], [base_radius,0]],
-            # arm head, with body attached
-            [[-base_radius,0]] + head_pts + [[base_radius,0]],
-        ]
-
         # arm angle in world coordinates
         world_arm_angle = \
             self.arm_zero + self.arm_angle_direction*self.model.get_arm_angle()
- 
-        transformed = [
-            transform(pts, offset=arm_offset, angle=world_arm_angle)
-            for pts in pts
-        ]
 
-        return transformed
-
-    def draw_disc(self):
-        disc_radius = self.model.get_disc_radius()
-
-        # points that make up a disc with marks 
-        # n.b. that the disc center is at the origin of the world
-        pts = [circle(disc_radius, resolution=50)]
-
-        # 8 radial lines, evenly spaced
-        pts += [
-            radial_line(0.9*disc_radius, disc_radius, angle=theta)
-            for theta in np.linspace(0,360,12)
-        ]
+        shape_args = (self.model.get_disc_radius(), self.model.get_arm_length())
+        return self.arm.update(shape_args, arm_offset, world_arm_angle)
 
+    def update_disc(self):
         # disc angle in world coordinates
         world_disc_angle = self.disc_angle_direction*self.model.get_disc_angle()
-        
-        transformed = [
-            transform(pts, angle=world_disc_angle)
-            for pts in pts
-        ]
-
-        return transformed
 
+        shape_args = (self.model.get_disc_radius(),)
+        return self.disc.update(shape_args, [0,0], world_disc_angle)
+
+    def arm_shape(self, disc_radius, arm_length):
+        """Linesets of a vertical arm, pivoting about the origin"""
+        return unpack_linesets(arm_shapes(disc_radius, arm_length), ARM_OFFSETS)
+
+    def disc_shape(self, disc_radius):
+        """Linesets of the disc with its marks, centered on the origin"""
+        return unpack_linesets(disc_shapes(disc_radius), DISC_OFFSETS)
+
+
+
+##########################
+# Vectorized evaluations #
+##########################
+
+# Where each lineset starts in the stacked points of arm_shapes/disc_shapes
+# (base, line across base, head with body attached)
+ARM_OFFSETS = np.array([0, 20, 22, 37])
+# (rim, then 12 radial marks)
+DISC_OFFSETS = np.array([0] + list(range(50, 75, 2)))
+
+SweepResult = namedtuple('SweepResult', ['head', 'points', 'offsets'])
+
+
+def arm_shapes(disc_radius, arm_length):
+    """Points of vertical arms pivoting about the origin, for arrays of disc
+    radii and arm lengths, stacked into shape (..., 37, 2).  Split into
+    linesets at ARM_OFFSETS."""
+    disc_radius, arm_length = np.broadcast_arrays(
+        np.asarray(disc_radius, dtype=float),
+        np.asarray(arm_length, dtype=float))
+    base_radius = disc_radius[...,None,None]/10.
+    arm_length = arm_length[...,None,None]
+
+    # scale the points in the head to match the base, and put the head into
+    # the center of the disk
+    head_pts = 10*base_radius*ARM_HEAD_PTS + arm_length*[0,1]
+
+    # points that make up a vertical arm
+    return np.concatenate([
+        # "base"
+        base_radius*unit_circle(20, 0, -180),
+        # line across base
+        base_radius*[[-1,0], [1,0]],
+        # arm head, with body attached
+        base_radius*[[-1,0]], head_pts, base_radius*[[1,0]],
+    ], axis=-2)
+
+def disc_shapes(disc_radius):
+    """Points of discs with their marks, centered on the origin, for an array
+    of disc radii, stacked into shape (..., 74, 2).  Split into linesets at
+    DISC_OFFSETS."""
+    disc_radius = np.asarray(disc_radius, dtype=float)[...,None,None]
+
+    # 12 radial marks, evenly spaced, each from 0.9 of the radius to the rim
+    marks = unit_ticks(12, 0, 360)[:,None,:]*np.array([0.9, 1])[:,None]
+    marks = disc_radius[...,None]*marks
+
+    return np.concatenate([
+        disc_radius*unit_circle(50, 0, 360),
+        marks.reshape(marks.shape[:-3] + (24,2)),
+    ], axis=-2)
+
+def evaluate_configs(disc_angle, arm_angle, arm_length, disc_radius,
+                     geometry=True, drawing=None):
+    """Evaluate many configurations of the mechanism at once.  The
+    parameters are arrays (or scalars) which broadcast against each other,
+    giving configurations of shape (...).
+
+    Returns a SweepResult with:
+        head:
+            (..., 2) world positions of the arm head (the point of the head
+            which is over the disc center at arm angle 0).
+        points, offsets:
+            (..., P, 2) world points of the whole drawing, in the order of
+            MechanismDrawing.draw_mechanism, and the offsets splitting them
+            into its linesets.  These are None unless `geometry` is set.
+
+    Angle directions are those of `drawing`, a MechanismDrawing."""
+    if drawing is None: drawing = MechanismDrawing(None)
+    disc_angle, arm_angle, arm_length, disc_radius = np.broadcast_arrays(
+        *[np.asarray(p, dtype=float)
+          for p in [disc_angle, arm_angle, arm_length, disc_radius]])
+
+    # angles in world coordinates
+    world_arm_angle = drawing.arm_zero + drawing.arm_angle_direction*arm_angle
+    world_disc_angle = drawing.disc_angle_direction*disc_angle
+
+    # the arm pivots about a point below the center of the disc
+    arm_offset = np.stack([np.zeros_like(arm_length), -arm_length], axis=-1)
+    head = arm_offset + arm_length[...,None]*np.stack([
+        -np.sin(np.radians(world_arm_angle)),
+        np.cos(np.radians(world_arm_angle)),
+    ], axis=-1)
+
+    if not geometry:
+        return SweepResult(head, None, None)
+
+    arm = batch_transform(arm_shapes(disc_radius, arm_length),
+                          offset=arm_offset, angle=world_arm_angle)
+    disc = batch_transform(disc_shapes(disc_radius), angle=world_disc_angle)
+    points = np.concatenate([arm, disc], axis=-2)
+    offsets = np.concatenate([ARM_OFFSETS, ARM_OFFSETS[-1] + DISC_OFFSETS[1:]])
+    return SweepResult(head, points, offsets)
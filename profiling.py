@@ -0,0 +1,192 @@
+"""Per-stage timers for the game loops.
+
+Wrap each stage of a frame in `with profiler.stage('update'):` (or decorate a
+function with `@profiler.timed('update')`).  Each stage keeps its durations
+over the last `window` frames, for percentiles, histograms and an on-screen
+overlay, and the whole lot can be written out as JSON along with a cProfile
+dump.  A disabled Profiler hands out one shared do-nothing timer, so the
+instrumented loops cost next to nothing until it is switched on.
+"""
+import collections
+import cProfile
+import functools
+import json
+import time
+
+import numpy as np
+import pygame
+
+
+def percentiles(samples):
+    """p50/p95/p99 of a list of durations in seconds, in milliseconds"""
+    ms = 1e3*np.asarray(samples)
+    return {
+        'p50': float(np.percentile(ms, 50)),
+        'p95': float(np.percentile(ms, 95)),
+        'p99': float(np.percentile(ms, 99)),
+    }
+
+
+
+class _NullTimer(object):
+    """Stands in for a StageTimer while profiling is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+
+
+class StageTimer(object):
+    """Context manager adding the time spent inside it to a rolling window
+    of durations (in seconds)"""
+    def __init__(self, window):
+        self.samples = collections.deque(maxlen=window)
+        self.total = 0.0
+        self.count = 0
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.samples.append(elapsed)
+        self.total += elapsed
+        self.count += 1
+        return False
+
+
+
+class Profiler(object):
+    """Timers for the stages of a game loop, by name, plus a count of the
+    frames which took longer than the frame rate allows"""
+    def __init__(self, enabled=False, window=300, fps=50):
+        self.enabled = enabled
+        self.window = window
+        self.frame_budget = 1000./fps
+        self.timers = collections.OrderedDict()
+        self.frames = collections.deque(maxlen=window)
+        self.missed_frames = 0
+        self.overlay = False
+        self.cprofile = None
+
+    def stage(self, name):
+        """Timer for the stage called `name`, to use in a with statement"""
+        if not self.enabled:
+            return NULL_TIMER
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = StageTimer(self.window)
+        return timer
+
+    def timed(self, name):
+        """Decorator timing each call of a function as the stage `name`"""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def timed_fn(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return timed_fn
+        return decorate
+
+    def frame(self, time_passed):
+        """Record the time (in ms) since the last frame, as clock.tick gives
+        it, counting it as missed if it is well over the frame budget"""
+        if not self.enabled:
+            return
+        self.frames.append(time_passed/1000.)
+        if time_passed > 1.5*self.frame_budget:
+            self.missed_frames += 1
+
+    def toggle(self):
+        """Switch timing and the overlay on or off together"""
+        self.enabled = self.overlay = not self.enabled
+
+    def reset(self):
+        self.timers.clear()
+        self.frames.clear()
+        self.missed_frames = 0
+
+    def stats(self):
+        """Percentiles (in milliseconds) of each stage over the window, and
+        of the frame times"""
+        stages = collections.OrderedDict()
+        for (name, timer) in self.timers.items():
+            if timer.samples:
+                stages[name] = dict(percentiles(timer.samples),
+                                    count=timer.count,
+                                    mean=1e3*timer.total/timer.count)
+        result = {'stages': stages, 'missed_frames': self.missed_frames}
+        if self.frames:
+            result['frames'] = percentiles(self.frames)
+        return result
+
+    def histogram(self, name, bins=10):
+        """(counts, edges) of the durations (in ms) of a stage over the
+        window"""
+        return np.histogram(1e3*np.asarray(self.timers[name].samples), bins)
+
+    #######################
+    # Exporting the stats #
+    #######################
+
+    def start_cprofile(self):
+        """Start recording every function call with cProfile (which slows
+        everything down a good deal)"""
+        self.cprofile = cProfile.Profile()
+        self.cprofile.enable()
+
+    def stop_cprofile(self, path):
+        """Stop recording calls, writing them to `path` for pstats"""
+        self.cprofile.disable()
+        self.cprofile.dump_stats(path)
+        self.cprofile = None
+
+    def dump(self, path):
+        """Write the stats, with a histogram of each stage, to `path` as
+        JSON"""
+        result = self.stats()
+        result['histograms'] = dict(
+            (name, dict(zip(['counts', 'edges_ms'],
+                            [a.tolist() for a in self.histogram(name)])))
+            for name in result['stages'])
+        with open(path, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    ###########
+    # Overlay #
+    ###########
+
+    def draw_overlay(self, surface, position=(5,5)):
+        """Draw the p50/p95 time of each stage onto `surface`, returning the
+        rect drawn to (None if the overlay is off)"""
+        if not self.overlay:
+            return None
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = pygame.font.Font(None, 18)
+        stats = self.stats()
+        lines = ["%-10s p50 %6.2f  p95 %6.2f ms" % (name, s['p50'], s['p95'])
+                 for (name, s) in stats['stages'].items()]
+        lines.append("missed frames: %d" % stats['missed_frames'])
+        images = [font.render(line, True, (255,255,255), (0,0,0))
+                  for line in lines]
+        rect = pygame.Rect(position, (
+            max(image.get_width() for image in images),
+            sum(image.get_height() for image in images)))
+        y = rect.top
+        for image in images:
+            surface.blit(image, (rect.left, y))
+            y += image.get_height()
+        return rect
+
+
+# A profiler which is always off, for code to time itself with by default
+OFF = Profiler(enabled=False)
@@ -0,0 +1,229 @@
+"""Spatial indexes over points and segments, in pure NumPy."""
+import numpy as np
+
+import geometry
+
+
+class SegmentGrid(object):
+    """Uniform grid over the bounding boxes of the segments of a list of
+    linesets, for finding the segments inside a rectangle without looking
+    at the others"""
+    def __init__(self, lines, cell_size=None):
+        self.lines = lines
+        self.pts, self.offsets = geometry.pack_linesets(lines)
+        # Indexes of simplified versions of the linesets, by tolerance
+        self.versions = {}
+
+        # Segment k joins pts[k] and pts[k+1], unless that crosses from one
+        # lineset to the next
+        joins = np.ones(max(len(self.pts) - 1, 0), dtype=bool)
+        ends = self.offsets[1:-1]
+        joins[ends[(ends > 0) & (ends < len(self.pts))] - 1] = False
+        self.segments = np.flatnonzero(joins)
+        a = self.pts[self.segments]
+        b = self.pts[self.segments + 1]
+        self.lo = np.minimum(a, b)
+        self.hi = np.maximum(a, b)
+
+        if cell_size is None:
+            # Aim for a few segments per occupied cell
+            lengths = (self.hi - self.lo).max(axis=1)
+            cell_size = 4*np.median(lengths) if len(lengths) else 1.0
+        self.cell_size = cell_size or 1.0
+
+        # Register each segment in every cell its bounding box touches
+        if len(self.segments):
+            self.origin = self.lo.min(axis=0)
+        else:
+            self.origin = np.zeros(2)
+        c0 = self.cell(self.lo)
+        c1 = self.cell(self.hi)
+        self.n_rows = int(c1[:,1].max()) + 1 if len(c1) else 1
+        spans = c1 - c0 + 1
+        counts = spans[:,0]*spans[:,1]
+        entry = np.repeat(np.arange(len(counts)), counts)
+        within = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts)
+        cx = c0[entry,0] + within // spans[entry,1]
+        cy = c0[entry,1] + within % spans[entry,1]
+        keys = cx*self.n_rows + cy
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.entries = entry[order]
+
+    def __len__(self):
+        return len(self.segments)
+
+    def simplified(self, tolerance):
+        """Index of the linesets simplified to `tolerance` (built once for
+        each tolerance)"""
+        if tolerance not in self.versions:
+            self.versions[tolerance] = SegmentGrid(
+                [geometry.simplify(lineset, tolerance)
+                 for lineset in self.lines])
+        return self.versions[tolerance]
+
+    def cell(self, x):
+        return np.floor((x - self.origin)/self.cell_size).astype(np.int64)
+
+    def query(self, lo, hi):
+        """Sorted indices (into `segments`) of the segments whose bounding
+        boxes meet the rectangle from corner `lo` to corner `hi`"""
+        if not len(self.segments):
+            return np.zeros(0, dtype=int)
+        c0 = np.maximum(self.cell(np.asarray(lo)), 0)
+        c1 = np.minimum(self.cell(np.asarray(hi)),
+                        [self.keys[-1] // self.n_rows, self.n_rows - 1])
+        if (c1 < c0).any():
+            return np.zeros(0, dtype=int)
+        # The cells of each grid column in the rectangle are contiguous keys
+        columns = np.arange(c0[0], c1[0] + 1)*self.n_rows
+        starts = np.searchsorted(self.keys, columns + c0[1])
+        stops = np.searchsorted(self.keys, columns + c1[1], side='right')
+        found = np.unique(np.concatenate(
+            [self.entries[i:j] for (i, j) in zip(starts, stops)]))
+        inside = (self.hi[found] >= lo).all(axis=1) & \
+                 (self.lo[found] <= hi).all(axis=1)
+        return found[inside]
+
+    def runs(self, found):
+        """Linesets covering the segments `found` (as from `query`), joining
+        up consecutive segments"""
+        if not len(found):
+            return []
+        first = self.segments[found]
+        breaks = np.flatnonzero(np.diff(first) != 1) + 1
+        starts = np.concatenate([[0], breaks])
+        stops = np.concatenate([breaks, [len(first)]])
+        return [self.pts[first[i]:first[j-1]+2] for (i, j) in zip(starts, stops)]
+
+
+
+class PointGrid(object):
+    """Uniform grid (a spatial hash) over a set of points, for finding
+    nearby pairs of points in roughly linear time, or the points near
+    any one place"""
+    def __init__(self, pts, cell_size):
+        self.pts = np.asarray(pts, dtype=float).reshape(-1,2)
+        self.cell_size = cell_size
+        self.origin = self.pts.min(axis=0) if len(self.pts) else np.zeros(2)
+        cells = self.cell(self.pts)
+        # One spare row each side, so neighbouring keys never wrap around
+        self.n_rows = int(cells[:,1].max()) + 3 if len(cells) else 3
+        keys = self.key(cells)
+        self.order = np.argsort(keys, kind='stable')
+        self.cell_keys, self.starts, self.counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True)
+        # Points of each cell, for the nearest-point search (built lazily)
+        self.members = None
+
+    def __len__(self):
+        return len(self.pts)
+
+    def cell(self, x):
+        return np.floor((x - self.origin)/self.cell_size).astype(np.int64) + 1
+
+    def key(self, cells):
+        return cells[...,0]*self.n_rows + cells[...,1]
+
+    def pairs(self, radius=None, half=True):
+        """Index arrays (a, b) of the pairs of points in the same or
+        neighbouring cells, which are within `radius` of each other if given
+        (radius must be at most the cell size).  With `half`, each unordered
+        pair is given once; otherwise both ways round."""
+        if half:
+            offsets = [(0,0), (1,-1), (1,0), (1,1), (0,1)]
+        else:
+            offsets = [(dx,dy) for dx in [-1,0,1] for dy in [-1,0,1]]
+        a_all = []
+        b_all = []
+        for (dx, dy) in offsets:
+            i = np.arange(len(self.cell_keys))
+            j = np.searchsorted(self.cell_keys, self.cell_keys + dx*self.n_rows + dy)
+            j = np.minimum(j, len(self.cell_keys) - 1)
+            found = self.cell_keys[j] == self.cell_keys + dx*self.n_rows + dy
+            i, j = i[found], j[found]
+            ci = self.counts[i]
+            cj = self.counts[j]
+            sizes = ci*cj
+            block = np.repeat(np.arange(len(sizes)), sizes)
+            within = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            local_a = within // cj[block]
+            local_b = within % cj[block]
+            if (dx, dy) == (0, 0):
+                keep = local_a < local_b if half else local_a != local_b
+                block, local_a, local_b = block[keep], local_a[keep], local_b[keep]
+            a_all.append(self.order[self.starts[i][block] + local_a])
+            b_all.append(self.order[self.starts[j][block] + local_b])
+        a = np.concatenate(a_all)
+        b = np.concatenate(b_all)
+        if radius is not None:
+            d = self.pts[a] - self.pts[b]
+            close = (d**2).sum(axis=1) <= radius**2
+            a, b = a[close], b[close]
+        return a, b
+
+    def within(self, x, radius):
+        """Sorted indices of the points within `radius` of `x`"""
+        x = np.asarray(x, dtype=float)
+        c0 = self.cell(x - radius)
+        c1 = self.cell(x + radius)
+        # Keep to the grid's rows, so the keys of a column don't run on
+        # into the next one
+        y0 = max(c0[1], 0)
+        y1 = min(c1[1], self.n_rows - 1)
+        if y1 < y0 or not len(self.cell_keys):
+            return np.zeros(0, dtype=int)
+        # The cells of each column in range are contiguous, and so are
+        # their points in `order`
+        columns = np.arange(c0[0], c1[0] + 1)*self.n_rows
+        first = np.searchsorted(self.cell_keys, columns + y0)
+        last = np.searchsorted(self.cell_keys, columns + y1, side='right')
+        bounds = np.append(self.starts, len(self.pts))
+        found = np.concatenate(
+            [self.order[bounds[i]:bounds[j]] for (i, j) in zip(first, last)])
+        close = ((self.pts[found] - x)**2).sum(axis=1) <= radius**2
+        return np.sort(found[close])
+
+    def nearest(self, x, active, max_rings=8):
+        """Index of the point nearest to `x` among those where the boolean
+        array `active` is set, or None if there are none.  Inactive points
+        are dropped from the grid as they are come across.  If nothing is
+        found within `max_rings` rings of cells, all the active points are
+        checked at once instead."""
+        if self.members is None:
+            self.members = dict(
+                (k, list(self.order[s:s+c]))
+                for (k, s, c) in zip(self.cell_keys, self.starts, self.counts))
+        cx, cy = self.cell(np.asarray(x, dtype=float))
+        x0, y0 = float(x[0]), float(x[1])
+        # Enough rings to reach every cell of the grid
+        last_column = self.cell_keys[-1]//self.n_rows if len(self) else 0
+        max_ring = int(max(abs(cx), abs(last_column - cx),
+                           abs(cy), abs(self.n_rows - 1 - cy)))
+        best = None
+        best_d2 = np.inf
+        for ring in range(max_ring + 1):
+            # Nothing further out can beat what we have
+            if best is not None and best_d2 <= ((ring - 1)*self.cell_size)**2:
+                break
+            if ring > max_rings:
+                candidates = np.flatnonzero(active)
+                if not len(candidates):
+                    return None
+                d2 = ((self.pts[candidates] - [x0, y0])**2).sum(axis=1)
+                return int(candidates[np.argmin(d2)])
+            for gx in range(cx - ring, cx + ring + 1):
+                edge = gx in (cx - ring, cx + ring)
+                for gy in (range(cy - ring, cy + ring + 1) if edge
+                           else (cy - ring, cy + ring)):
+                    members = self.members.get(gx*self.n_rows + gy)
+                    if not members:
+                        continue
+                    members[:] = [m for m in members if active[m]]
+                    for m in members:
+                        px, py = self.pts[m]
+                        d2 = (px - x0)**2 + (py - y0)**2
+                        if d2 < best_d2:
+                            best, best_d2 = m, d2
+        return best
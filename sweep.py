@@ -0,0 +1,199 @@
+"""Sweeps of the mechanism over a grid of parameters, spread over a pool of
+processes and streamed to disk.
+
+The grid is cut into shards of consecutive configurations.  Each shard is
+evaluated with mechanism.evaluate_configs and written to the output directory
+as shard_NNNNN.head.npy (arm-head positions), shard_NNNNN.points.npy (drawing
+geometry) and shard_NNNNN.stats.json (summary statistics, written last).
+Shards which already have their statistics are skipped, so an interrupted
+sweep can be resumed by running it again with the same grid.
+"""
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+import mechanism
+
+PARAMETERS = ['disc_angle', 'arm_angle', 'arm_length', 'disc_radius']
+
+
+class ParameterGrid(object):
+    """Every combination of the given values of each mechanism parameter,
+    in C order (the last parameter varies fastest)"""
+    def __init__(self, disc_angle, arm_angle, arm_length, disc_radius):
+        self.values = [
+            np.atleast_1d(np.asarray(v, dtype=float))
+            for v in [disc_angle, arm_angle, arm_length, disc_radius]]
+        self.shape = tuple(len(v) for v in self.values)
+
+    def __len__(self):
+        return int(np.prod(self.shape))
+
+    def configs(self, start, stop):
+        """Parameter arrays for the configurations start..stop of the grid"""
+        indices = np.unravel_index(np.arange(start, stop), self.shape)
+        return [v[i] for (v, i) in zip(self.values, indices)]
+
+    def manifest(self):
+        return dict(zip(PARAMETERS, [v.tolist() for v in self.values]))
+
+
+
+##############
+# Statistics #
+##############
+
+def shard_stats(head, points=None):
+    """Mergeable statistics of a shard's results"""
+    if len(head) == 0:
+        return {'count': 0}
+    stats = {
+        'count': len(head),
+        'head_sum': head.sum(axis=0).tolist(),
+        'head_sumsq': (head**2).sum(axis=0).tolist(),
+        'head_min': head.min(axis=0).tolist(),
+        'head_max': head.max(axis=0).tolist(),
+    }
+    if points is not None:
+        stats['points_min'] = points.min(axis=(0,1)).tolist()
+        stats['points_max'] = points.max(axis=(0,1)).tolist()
+    return stats
+
+def merge_stats(shards):
+    """Combine the statistics of many shards into a summary of them all.
+    With no configurations at all, everything but the counts is None."""
+    count = sum(s['count'] for s in shards)
+    summary = {'count': count, 'shards': len(shards)}
+    if count == 0:
+        summary.update(head_mean=None, head_std=None,
+                       head_min=None, head_max=None)
+        return summary
+    shards = [s for s in shards if s['count'] > 0]
+    head_sum = np.sum([s['head_sum'] for s in shards], axis=0)
+    head_sumsq = np.sum([s['head_sumsq'] for s in shards], axis=0)
+    mean = head_sum/count
+    summary.update({
+        'head_mean': mean.tolist(),
+        'head_std': np.sqrt(np.maximum(head_sumsq/count - mean**2, 0)).tolist(),
+        'head_min': np.min([s['head_min'] for s in shards], axis=0).tolist(),
+        'head_max': np.max([s['head_max'] for s in shards], axis=0).tolist(),
+    })
+    if all('points_min' in s for s in shards):
+        summary['points_min'] = \
+            np.min([s['points_min'] for s in shards], axis=0).tolist()
+        summary['points_max'] = \
+            np.max([s['points_max'] for s in shards], axis=0).tolist()
+    return summary
+
+
+
+##########
+# Shards #
+##########
+
+def shard_path(out_dir, index, kind):
+    return os.path.join(out_dir, "shard_%05d.%s" % (index, kind))
+
+def _save(path, write):
+    """Write a file through a temporary name, so that it either exists
+    complete or not at all"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+def _evaluate_shard(task):
+    """Evaluate one shard and write it to disk (in a worker process)"""
+    (grid, index, start, stop, out_dir, geometry) = task
+    result = mechanism.evaluate_configs(
+        *grid.configs(start, stop), geometry=geometry)
+    if geometry:
+        _save(shard_path(out_dir, index, 'points.npy'),
+              lambda f: np.save(f, result.points))
+    _save(shard_path(out_dir, index, 'head.npy'),
+          lambda f: np.save(f, result.head))
+    stats = shard_stats(result.head, result.points)
+    _save(shard_path(out_dir, index, 'stats.json'),
+          lambda f: f.write(json.dumps(stats).encode()))
+    return index, stats
+
+
+
+class SweepExecutor(object):
+    """Runs a ParameterGrid sweep in shards of `chunk_size` configurations
+    over `processes` worker processes (all cores by default; 1 runs in this
+    process)"""
+    def __init__(self, out_dir, chunk_size=50000, processes=None,
+                 geometry=True):
+        self.out_dir = out_dir
+        self.chunk_size = chunk_size
+        self.processes = processes or multiprocessing.cpu_count()
+        self.geometry = geometry
+        # Shards found on disk by the last run
+        self.skipped = 0
+
+    def shards(self, grid):
+        """(index, start, stop) of every shard of the grid"""
+        for index, start in enumerate(range(0, len(grid), self.chunk_size)):
+            yield index, start, min(start + self.chunk_size, len(grid))
+
+    def completed(self, index):
+        """Statistics of a shard written by an earlier run, or None"""
+        path = shard_path(self.out_dir, index, 'stats.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def check_manifest(self, grid):
+        """Record the sweep's settings in the output directory, refusing to
+        resume into a directory written by a different sweep"""
+        manifest = {
+            'grid': grid.manifest(),
+            'chunk_size': self.chunk_size,
+            'geometry': self.geometry,
+        }
+        path = os.path.join(self.out_dir, 'manifest.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                if json.load(f) != manifest:
+                    raise ValueError(
+                        "%s holds the shards of a different sweep" %
+                        self.out_dir)
+        else:
+            _save(path, lambda f: f.write(json.dumps(manifest).encode()))
+
+    def run(self, grid):
+        """Evaluate every shard of the grid which isn't on disk yet, then
+        write and return the merged summary statistics"""
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.check_manifest(grid)
+
+        stats = {}
+        tasks = []
+        for (index, start, stop) in self.shards(grid):
+            done = self.completed(index)
+            if done is not None:
+                stats[index] = done
+            else:
+                tasks.append(
+                    (grid, index, start, stop, self.out_dir, self.geometry))
+        self.skipped = len(stats)
+
+        if self.processes == 1:
+            stats.update(map(_evaluate_shard, tasks))
+        else:
+            with multiprocessing.Pool(self.processes) as pool:
+                stats.update(pool.imap_unordered(_evaluate_shard, tasks))
+
+        summary = merge_stats([stats[i] for i in sorted(stats)])
+        _save(os.path.join(self.out_dir, 'summary.json'),
+              lambda f: f.write(json.dumps(summary, indent=2).encode()))
+        return summary
+
+    def load(self, index, kind='head'):
+        """Memory-map one shard's results"""
+        return np.load(shard_path(self.out_dir, index, kind + '.npy'),
+                       mmap_mode='r')
@@ -1,9 +1,25 @@
+import io
+import json
+import os
+import pstats
+import random
+import tracemalloc
 import pytest
 
 import numpy as np
 import pygame
 import geometry
+import assets
+import creeps
 import drawing
+import export
+import headless
+import mechanism
+import profiling
+import spatial
+import sweep
+import tracing
+import travel
 
 prec = 1e-12
 
@@ -93,3 +109,722 @@ def test_stacked_canvases(stacked_canvases):
     assert near(vec, np.array([50,122]))
 
 
+
+def test_transform_shapes():
+    one = geometry.transform([1,0], offset=[1,1], angle=90, scale=2)
+    assert one.shape == (2,)
+    assert near(one, np.array([1,3]))
+    many = geometry.transform([[1,0],[0,1]], angle=90)
+    assert near(many, np.array([[0,1],[-1,0]]))
+    stacked = np.random.random((3,4,2))
+    out = geometry.transform(stacked, offset=[1,2], angle=30, scale=2)
+    assert out.shape == (3,4,2)
+    assert near(out[1], geometry.transform(stacked[1], [1,2], 30, 2))
+
+def test_affine_matrix():
+    M = geometry.affine_matrix([1,2], angle=30, scale=2)
+    pts = np.random.random((5,2))
+    assert near(geometry.apply_affine(M, pts),
+                geometry.transform(pts, [1,2], angle=30, scale=2))
+    assert near(geometry.apply_affine(M, pts, rel=True),
+                geometry.transform(pts, angle=30, scale=2))
+
+def test_world_matrix_cache(stacked_coords):
+    (c, d) = stacked_coords
+    d.origin = np.array([1,0])
+    M = d.world_matrix()
+    assert d.world_matrix() is M
+    c.angle = 90
+    assert d.world_matrix() is not M
+    assert near(d.to_coords([0,0]), np.array([0,1]))
+    c.origin += [1,1]
+    assert near(d.to_coords([0,0]), np.array([1,2]))
+    # The origin is a copy of what it was set to
+    origin = np.array([0.,0.])
+    c.origin = origin
+    d.to_coords([0,0])
+    origin[0] = 5
+    assert near(d.to_coords([0,0]), np.array([0,1]))
+    assert near(d.from_coords(d.to_coords([3,4])), np.array([3,4]))
+
+def test_deep_hierarchy():
+    root = geometry.CoordinateSystem(scale=2, origin=[1,0], angle=10)
+    node = root
+    for i in range(20):
+        node = geometry.CoordinateSystem(
+            scale=1.1, origin=[0,1], angle=5, parent=node)
+    # Compare against walking the chain one level at a time
+    pts = np.random.random((10,2))
+    expected = pts
+    walk = node
+    while walk is not None:
+        expected = walk._to_coords(expected)
+        walk = walk.parent
+    assert np.allclose(node.to_coords(pts), expected)
+    assert np.allclose(node.from_coords(expected), pts)
+
+def test_pack_linesets():
+    lines = [[[0,0],[1,1],[2,0]], np.array([[5,5],[6,6]])]
+    pts, offsets = geometry.pack_linesets(lines)
+    assert pts.shape == (5,2)
+    assert list(offsets) == [0,3,5]
+    back = geometry.unpack_linesets(pts, offsets)
+    assert len(back) == 2
+    assert near(back[1], np.array([[5,5],[6,6]]))
+
+def test_project_lines(canvas):
+    canvas.coords.scale = 2
+    lines = [[[0,0],[1,1],[2,0]], [[5,5],[6,6]]]
+    projected = canvas.project_lines(lines)
+    for lineset, pixels in zip(lines, projected):
+        for pt, px in zip(lineset, pixels):
+            assert near(px, canvas.world_coords(pt))
+
+def test_circle_template():
+    pts = geometry.circle(2, center=[1,1], start=10, end=-170, resolution=7)
+    expected = [geometry.transform(geometry.rot2d(th, [1,0]), [1,1], scale=2)
+                for th in np.linspace(10, -170, 7)]
+    assert np.allclose(pts, expected)
+    with pytest.raises(ValueError):
+        geometry.unit_circle(7, 10, -170)[0,0] = 5
+
+def test_radial_lines_template():
+    lines = geometry.radial_lines(0.5, 1, center=[1,0], resolution=12)
+    for line, theta in zip(lines, np.linspace(0, 360, 12)):
+        assert np.allclose(line, geometry.radial_line(0.5, 1, [1,0], theta))
+
+def test_steady_state_templates():
+    mech = mechanism.MechanismDrawing(mechanism.MechanismModel())
+    mech.draw_mechanism()
+    before = geometry.template_cache_info()
+    mech.model.disc_radius += 1
+    mech.model.arm_angle += 5
+    mech.draw_mechanism()
+    after = geometry.template_cache_info()
+    for name in before:
+        assert after[name].misses == before[name].misses
+        assert after[name].hits > before[name].hits
+
+@pytest.fixture
+def mech():
+    return mechanism.MechanismDrawing(mechanism.MechanismModel())
+
+def test_scene_reuses_unchanged_frames(mech):
+    first = mech.draw_mechanism()
+    assert mech.draw_mechanism() is first
+    disc = mech.disc.output
+    mech.model.arm_angle += 10
+    second = mech.draw_mechanism()
+    assert second is not first
+    # Only the arm moved, so the disc geometry is reused as is
+    assert mech.disc.output is disc
+    assert list(second[len(mech.arm.output):]) == disc
+    # Moving a part through draw_disc still redraws the whole mechanism
+    mech.model.disc_angle += 10
+    disc = mech.draw_disc()
+    third = mech.draw_mechanism()
+    assert third is not second
+    assert list(third[len(mech.arm.output):]) == disc
+    # Callers can't change the shared geometry
+    with pytest.raises(ValueError):
+        third[0][0] = 0
+
+def test_scene_matches_shapes(mech):
+    mech.model.arm_angle = 30
+    mech.model.disc_angle = 45
+    mech.model.disc_radius = 4
+    arm = mech.arm_shape(4, mech.model.arm_length)
+    for lineset, drawn in zip(arm, mech.draw_arm()):
+        expected = geometry.transform(
+            lineset, offset=[0,-mech.model.arm_length], angle=-30)
+        assert np.allclose(drawn, expected)
+    for lineset, drawn in zip(mech.disc_shape(4), mech.draw_disc()):
+        assert np.allclose(drawn, geometry.transform(lineset, angle=-45))
+
+@pytest.fixture
+def display():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    yield pygame.display.set_mode((200,200))
+    pygame.display.quit()
+
+def test_render_scheduler(display, mech):
+    canvas = drawing.Canvas(display, scale=0.1)
+    scheduler = drawing.RenderScheduler()
+    for frame in range(3):
+        state = mech.model.state()
+        if scheduler.needs_render(canvas, state):
+            canvas.clear_canvas()
+            canvas.draw_lines(mech.draw_mechanism())
+            scheduler.present(canvas, state)
+    assert scheduler.stats() == {'rendered': 1, 'skipped': 2}
+    mech.model.arm_angle += 5
+    assert scheduler.needs_render(canvas, mech.model.state())
+    canvas.coords.scale = 0.2
+    assert scheduler.needs_render(canvas, scheduler.state)
+
+def test_offscreen_renderer():
+    renderer = headless.OffscreenRenderer((200,200))
+    timings = dict((stage, []) for stage in headless.STAGES)
+    surface = renderer.render(timings)
+    # Something other than the white background was drawn
+    assert pygame.transform.average_color(surface)[:3] != (255,255,255)
+    assert all(len(timings[stage]) == 1 for stage in headless.STAGES)
+
+def test_frame_benchmark():
+    results = headless.frame_benchmark(resolutions=[(100,100)], steps=3)
+    assert results[0]['frames'] == 9
+    p = results[0]['stages']['total']
+    assert p['p50'] <= p['p95'] <= p['p99']
+
+def test_evaluate_configs(mech):
+    disc_angle = np.array([0, 30, -45])
+    arm_angle = np.array([10, 0, 200])
+    arm_length = np.array([7, 6, 8])
+    disc_radius = np.array([5, 4, 3])
+    result = mechanism.evaluate_configs(
+        disc_angle, arm_angle, arm_length, disc_radius)
+    assert result.head.shape == (3,2)
+    for i in range(3):
+        mech.model.disc_angle = disc_angle[i]
+        mech.model.arm_angle = arm_angle[i]
+        mech.model.arm_length = arm_length[i]
+        mech.model.disc_radius = disc_radius[i]
+        pts, offsets = geometry.pack_linesets(mech.draw_mechanism())
+        assert np.allclose(result.points[i], pts)
+        assert list(result.offsets) == list(offsets)
+        pivot = np.array([0, -arm_length[i]])
+        expected = pivot + geometry.rot2d(-arm_angle[i], [0, arm_length[i]])
+        assert np.allclose(result.head[i], expected)
+
+def test_evaluate_configs_broadcasts():
+    angles = np.linspace(0, 360, 5)
+    result = mechanism.evaluate_configs(
+        angles[:,None], angles[None,:], 7, 5, geometry=False)
+    assert result.head.shape == (5,5,2)
+    assert result.points is None
+    # The head only depends on the arm
+    assert np.allclose(result.head[0], result.head[3])
+
+def test_sweep_executor(tmp_path):
+    grid = sweep.ParameterGrid(
+        [0, 90, 180, 270], [0, 45, 90], [6, 7], [4, 5])
+    executor = sweep.SweepExecutor(str(tmp_path), chunk_size=10, processes=2)
+    summary = executor.run(grid)
+    assert summary['count'] == 48
+    assert summary['shards'] == 5
+    heads = np.concatenate([executor.load(i) for i in range(5)])
+    expected = mechanism.evaluate_configs(
+        *np.meshgrid(*grid.values, indexing='ij'), geometry=False).head
+    assert np.allclose(heads, expected.reshape(-1,2))
+    assert np.allclose(summary['head_mean'], expected.reshape(-1,2).mean(0))
+    points = executor.load(3, 'points')
+    assert points.shape == (10, 111, 2)
+
+    # Resuming only redoes the missing shard
+    os.remove(sweep.shard_path(str(tmp_path), 2, 'stats.json'))
+    resumed = sweep.SweepExecutor(str(tmp_path), chunk_size=10, processes=1)
+    assert resumed.run(grid) == summary
+    assert resumed.skipped == 4
+    with pytest.raises(ValueError):
+        sweep.SweepExecutor(str(tmp_path), chunk_size=5).run(grid)
+
+def test_sweep_empty(tmp_path):
+    assert sweep.merge_stats([]) == {
+        'count': 0, 'shards': 0, 'head_mean': None, 'head_std': None,
+        'head_min': None, 'head_max': None}
+    grid = sweep.ParameterGrid([], [0, 45], [7], [5])
+    summary = sweep.SweepExecutor(str(tmp_path), processes=1).run(grid)
+    assert summary['count'] == summary['shards'] == 0
+    # Empty shards don't spoil the others
+    head = np.array([[1., 2.], [3., 4.]])
+    merged = sweep.merge_stats([sweep.shard_stats(head[:0]),
+                                sweep.shard_stats(head)])
+    assert merged['count'] == 2 and merged['shards'] == 2
+    assert merged['head_mean'] == [2., 3.] and merged['head_min'] == [1., 2.]
+
+def test_trace_chunks():
+    model = mechanism.MechanismModel(arm_length=7)
+    model.arm_angle = 90
+    chunks = list(tracing.trace(36, 0, duration=10, dt=0.01,
+                                model=model, chunk_size=300))
+    assert [len(c) for c in chunks] == [300, 300, 300, 101]
+    path = np.concatenate(chunks)
+    # With the arm still, the pen circles the disc center
+    assert np.allclose(np.hypot(path[:,0], path[:,1]), 7*np.sqrt(2))
+    assert near(path[0], np.array([7,-7]))
+    # ... once in 10s at 36 degrees per second
+    assert near(path[-1], path[0])
+    # The disc turns clockwise on screen, so the pen turns the other way
+    assert near(path[250], geometry.transform(path[0], angle=90))
+
+def test_trace_schedules():
+    model = mechanism.MechanismModel()
+    constant = np.concatenate(list(tracing.trace(
+        20, -15, duration=2, model=model, chunk_size=50)))
+    scheduled = np.concatenate(list(tracing.trace(
+        lambda t: np.full_like(t, 20), lambda t: np.full_like(t, -15),
+        duration=2, model=model, chunk_size=64)))
+    assert np.allclose(constant, scheduled)
+    schedule = tracing.AngleSchedule(lambda t: 2*t)
+    angles = np.concatenate([schedule.angles(np.linspace(0, 1, 11)),
+                             schedule.angles(np.linspace(1.1, 2, 10))])
+    assert np.allclose(angles, np.linspace(0, 2, 21)**2)
+
+def test_trace_layer():
+    c = drawing.Canvas(pygame.Surface((200,200)), pxres=10)
+    trace = drawing.TraceLayer(c, budget=1000)
+    path = np.concatenate(list(tracing.trace(90, 37, duration=20, dt=0.01)))
+    trace.extend(path[:1500]).update()
+    assert trace.drawn == 1000
+    trace.update()
+    assert trace.pending() == 0
+    trace.draw()
+    assert len(c.drawn_rects) == 2
+    # New points are drawn on their own, joined to the old ones
+    trace.extend(path[1500:1510]).update().draw()
+    assert trace.drawn == 1510
+    assert len(c.drawn_rects) == 3
+    assert c.drawn_rects[-1].width < 20
+    # Moving the view rasterizes everything again, a budget at a time
+    c.coords.scale = 2
+    trace.update()
+    assert trace.drawn == 1000
+    trace.update()
+    assert trace.pending() == 0
+    # Clearing erases the whole layer from the display
+    trace.draw()
+    c.drawn_rects = []
+    trace.clear().update().draw()
+    assert c.drawn_rects == [trace.surface.get_rect()]
+
+def test_trace_layer_turns_with_disc():
+    c = drawing.Canvas(pygame.Surface((200,200)), pxres=10)
+    mech = mechanism.MechanismDrawing(mechanism.MechanismModel())
+    trace = drawing.TraceLayer(c)
+    # The pen path on the paper, ending at disc 90 / arm 30
+    disc = np.linspace(60, 90, 31)
+    arm = np.linspace(0, 30, 31)
+    trace.extend(tracing.pen_positions(disc, arm, 7, 5, mech))
+    trace.angle = mech.disc_angle_direction*90
+    c.clear_canvas()
+    trace.update().draw()
+    head = mechanism.evaluate_configs(90, 30, 7, 5, geometry=False,
+                                      drawing=mech).head
+    x, y = np.round(c.world_coords(head)).astype(int)
+    window = pygame.surfarray.array3d(c.rect)[x-1:x+2, y-1:y+2].astype(int)
+    # The newest part of the trace is under the pen
+    assert (window[...,2] > window[...,0] + 50).any()
+    # Turning the layer marks where it was and where it is now
+    rects = list(c.drawn_rects)
+    c.drawn_rects = []
+    trace.angle = mech.disc_angle_direction*95
+    trace.draw()
+    assert c.drawn_rects[0] == rects[-1] and len(c.drawn_rects) == 2
+    turned = trace.turned_rect
+    # While the disc stays put, only the new segments are drawn
+    c.drawn_rects = []
+    trace.extend(tracing.pen_positions(disc[20:10:-1], arm[20:10:-1],
+                                       7, 5, mech))
+    c.clear_canvas()
+    trace.update().draw()
+    assert trace.turned_rect == turned and len(c.drawn_rects) == 1
+    assert turned.contains(c.drawn_rects[0])
+    kept = pygame.surfarray.array3d(c.rect).astype(int)
+    # and look the same as if the layer were rotated again
+    trace.turned = None
+    c.clear_canvas()
+    trace.draw()
+    fresh = pygame.surfarray.array3d(c.rect).astype(int)
+    inside = (slice(turned.left, turned.right),
+              slice(turned.top, turned.bottom))
+    assert np.abs(kept - fresh)[inside].mean() < 5 < fresh[inside].std()
+    # and nothing at all when nothing changed
+    c.drawn_rects = []
+    trace.update().draw()
+    assert c.drawn_rects == []
+
+def test_simplify():
+    t = np.linspace(0, 20, 5000)
+    path = np.stack([np.cos(t)*t, np.sin(t)*t], axis=-1)
+    simple = geometry.simplify(path, 0.05)
+    assert len(simple) < len(path)/5
+    assert near(simple[0], path[0]) and near(simple[-1], path[-1])
+    # Every original point is within tolerance of the simplified path
+    a = simple[:-1]
+    d = simple[1:] - a
+    rel = path[:,None,:] - a[None,:,:]
+    u = np.clip((rel*d).sum(-1)/(d**2).sum(-1), 0, 1)
+    dist = np.hypot(*np.moveaxis(rel - u[...,None]*d, -1, 0)).min(axis=1)
+    assert dist.max() <= 0.05
+
+def test_level_of_detail(canvas):
+    t = np.linspace(0, 20, 5000)
+    path = np.stack([np.cos(t)*t, np.sin(t)*t], axis=-1)
+    canvas.coords.scale = 0.1
+    first = canvas.project_lines([path])[0]
+    assert len(first) < len(path)
+    assert canvas.lod.misses == 1
+    canvas.project_lines([path])
+    assert canvas.lod.hits == 1
+    # Zooming in a lot needs more detail
+    canvas.coords.scale = 10
+    assert len(canvas.project_lines([path])[0]) > len(first)
+    assert canvas.lod.misses == 2
+
+def test_segment_grid():
+    rng = np.random.default_rng(1)
+    lines = [np.cumsum(rng.normal(size=(n,2)), axis=0) + rng.uniform(-50,50,2)
+             for n in [1, 20, 200, 3, 500]]
+    index = spatial.SegmentGrid(lines)
+    assert len(index) == sum(len(l) - 1 for l in lines)
+    lo, hi = np.array([-10,-20]), np.array([15,5])
+    found = index.query(lo, hi)
+    brute = np.flatnonzero((index.hi >= lo).all(1) & (index.lo <= hi).all(1))
+    assert list(found) == list(brute)
+    # The runs cover exactly the segments found
+    runs = index.runs(found)
+    assert sum(len(run) - 1 for run in runs) == len(found)
+
+def test_draw_index_culls(canvas):
+    t = np.linspace(0, 200, 20000)
+    path = np.stack([np.cos(t), np.sin(t)], axis=-1)*t[:,None]/10
+    index = spatial.SegmentGrid([path])
+    canvas.coords.scale = 0.01
+    canvas.draw_index(index)
+    assert canvas.cull_stats['culled'] == 0
+    # Zoomed in, most of the path is off the canvas
+    canvas.coords.scale = 2
+    canvas.draw_index(index)
+    drawn, culled = canvas.cull_stats['drawn'], canvas.cull_stats['culled']
+    assert 0 < drawn < culled/10
+    assert len(index.versions) == 2
+
+def test_draw_lines_culls(canvas):
+    canvas.draw_lines([[[0,0],[0.1,0.1],[0.2,0]], [[10,10],[11,11]]])
+    assert canvas.cull_stats == {'drawn': 2, 'culled': 1}
+
+def test_order_paths():
+    paths = [[[10,0],[11,0]], [[2,0],[1,0]], [[3,0],[4,0]]]
+    ordered = export.order_paths(paths)
+    assert [list(p[0]) for p in ordered] == [[1,0], [3,0], [10,0]]
+
+def test_export_svg(mech):
+    f = io.StringIO()
+    coords = geometry.CoordinateSystem(scale=10, origin=[100,150])
+    stats = export.write_svg(mech.draw_mechanism(), f, coords=coords)
+    svg = f.getvalue()
+    assert svg.count('<path') == stats['paths'] == len(mech.draw_mechanism())
+    assert stats['points'] == sum(len(l) for l in mech.draw_mechanism())
+    assert svg.rstrip().endswith('</svg>')
+    unordered = export.write_svg(mech.draw_mechanism(), io.StringIO(),
+                                 coords=coords, optimize=False)
+    assert stats['pen_up_distance'] < unordered['pen_up_distance']
+
+def test_export_gcode_trace():
+    f = io.StringIO()
+    # With the arm turned, the trace starts away from the origin
+    model = mechanism.MechanismModel()
+    model.arm_angle = 30
+    trace = tracing.trace(90, 37, duration=10, model=model, chunk_size=100)
+    stats = export.write_gcode([trace], f)
+    gcode = f.getvalue().splitlines()
+    # The only pen-up move is from the origin to the start of the trace
+    first = next(tracing.trace(90, 37, duration=10, model=model))[0]
+    assert np.hypot(*first) > 1
+    assert stats == {'paths': 1, 'points': 1001,
+                     'pen_up_distance': pytest.approx(np.hypot(*first))}
+    assert sum(line.startswith('G1 X') for line in gcode) == 1000
+    assert gcode.count('M3') == 1
+
+def test_travel_optimize():
+    rng = np.random.default_rng(2)
+    a = rng.random((500,2))*100
+    paths = [np.array([p, p + d]) for (p, d) in zip(a, rng.normal(size=(500,2)))]
+    ordered, report = travel.optimize(paths)
+    assert report['after'] <= report['nearest_neighbour'] < report['before']/5
+    # Every path is drawn once, possibly reversed
+    key = lambda p: tuple(np.round(np.sort(p, axis=0).ravel(), 9))
+    assert sorted(map(key, ordered)) == sorted(map(key, paths))
+    heads, tails = travel.endpoints(ordered)
+    travelled = np.hypot(*heads[0]) + np.hypot(*(heads[1:] - tails[:-1]).T).sum()
+    assert np.isclose(travelled, report['after'])
+    # Nothing to plan still gives the whole report
+    ordered, empty = travel.optimize([])
+    assert ordered == [] and sorted(empty) == sorted(report)
+
+def test_point_grid():
+    rng = np.random.default_rng(3)
+    pts = rng.random((300,2))
+    grid = spatial.PointGrid(pts, 0.1)
+    a, b = grid.pairs(0.1)
+    d = np.hypot(*(pts[:,None] - pts[None]).transpose(2,0,1))
+    assert len(a) == (d[np.triu_indices(300, 1)] <= 0.1).sum()
+    active = rng.random(300) < 0.3
+    d[:, ~active] = np.inf
+    for i in range(0, 300, 37):
+        assert grid.nearest(pts[i], active) == np.argmin(d[i])
+
+def test_creep_swarm(display):
+    # Creeps heading into each wall, and a pair of each kind of image
+    files = ['bluecreep.png', 'pinkcreep.png', 'graycreep.png']
+    starts = [((5,100), (-1,0)), ((195,100), (1,1)), ((100,5), (1,-1)),
+              ((100,195), (0,1)), ((10,10), (-1,-1)), ((100,100), (1,0))]
+    sprites = [creeps.Creep(display, files[i % 3], p, d, 0.1)
+               for (i, (p, d)) in enumerate(starts)]
+    swarm = creeps.CreepSwarm.from_creeps(sprites, np.random.default_rng(0))
+    # Too short for any turns: the swarm must match exactly
+    for step in range(19):
+        for creep in sprites:
+            creep.update(20)
+        swarm.update(20)
+        assert np.allclose(swarm.pos, [tuple(c.pos) for c in sprites])
+        assert np.allclose(swarm.direction, [tuple(c.direction) for c in sprites])
+        assert np.all(swarm.sizes() == [c.image.get_size() for c in sprites])
+    swarm.draw(display)
+
+def test_creep_swarm_turns():
+    rng = np.random.default_rng(1)
+    n = 1000
+    swarm = creeps.CreepSwarm(
+        (400,400), rng.random((n,2))*400, rng.choice([-1,1], (n,2)), 0.1,
+        rng=rng)
+    for step in range(200):
+        swarm.update(20)
+    assert ((swarm.pos >= 0) & (swarm.pos <= 400)).all()
+    angles = np.degrees(np.arctan2(*swarm.direction.T[::-1]))
+    assert np.allclose(np.round(angles/45)*45, angles)
+    assert (np.round(angles/45).astype(int) % 8 == swarm.octant).all()
+    # 4 seconds is 8 to 10 turns each, a third of them straight on
+    assert len(np.unique(swarm.octant)) == 8
+
+def test_rotation_cache(display):
+    cache = creeps.ROTATIONS
+    creep = creeps.Creep(display, 'pinkcreep.png', (100,100), (1,1), 0.1)
+    assert len(cache) >= 8
+    hits = cache.stats()['hits']
+    for step in range(100):
+        creep.update(20)
+        expected = pygame.transform.rotate(creep.base_image,
+                                           -creep.direction.angle)
+        assert (creep.image_w, creep.image_h) == expected.get_size()
+        assert creep.image.get_size() == expected.get_size()
+    # Images are only looked up when the direction changes
+    stats = cache.stats()
+    assert hits < stats['hits'] < hits + 100
+    assert stats['misses'] == 0 and stats['hit_rate'] == 1.0
+
+def test_creeps_outlast_reloads(display):
+    cache = creeps.ROTATIONS
+    creep = creeps.Creep(display, 'pinkcreep.png', (100,100), (1,1), 0.1)
+    creep.update(20)
+    bounds = len(cache._bounds)
+    for i in range(3):
+        # Images from another manager make new rotations of the file
+        cache.load('pinkcreep.png', assets.AssetManager().image('pinkcreep.png'))
+        creep.direction.rotate(90)
+        creep.update(20)
+        creep.blitme()
+    assert len(cache._bounds) <= bounds
+
+def test_asset_manager(display):
+    manager = assets.AssetManager()
+    files = ['bluecreep.png', 'pinkcreep.png', 'graycreep.png']
+    manager.preload(files[:2])
+    assert manager.stats()['loads'] == 2
+    sprites = [creeps.Creep(display, files[i % 3], (10,10), (1,0), 0.1,
+                            assets=manager)
+               for i in range(30)]
+    stats = manager.stats()
+    assert stats['images'] == stats['loads'] == 3
+    assert stats['hits'] == 30 - 1
+    assert sprites[0].base_image is sprites[3].base_image
+    assert stats['bytes'] == sum(manager.image(f).get_pitch()*
+                                 manager.image(f).get_height() for f in files)
+
+def test_asset_manager_converts_late():
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.quit()
+    pygame.display.init()
+    try:
+        manager = assets.AssetManager()
+        early = manager.image('bluecreep.png')
+        cache = creeps.RotationCache()
+        cache.load('bluecreep.png', early)
+        rotated = cache.rotations('bluecreep.png')
+        # Once there is a display, the image is converted on first use
+        pygame.display.set_mode((100,100))
+        image = manager.image('bluecreep.png')
+        assert image is not early
+        assert manager.image('bluecreep.png') is image
+        assert manager.stats()['loads'] == 1
+        # and its rotations are made again from the converted image
+        cache.load('bluecreep.png', image)
+        assert cache.rotations('bluecreep.png')[0][0] is not rotated[0][0]
+        again = cache.rotations('bluecreep.png')
+        cache.load('bluecreep.png', image)
+        assert cache.rotations('bluecreep.png') == again
+    finally:
+        pygame.display.quit()
+
+def test_batched_blits(display):
+    files = ['bluecreep.png', 'pinkcreep.png', 'graycreep.png']
+    rng = np.random.default_rng(4)
+    sprites = [creeps.Creep(display, files[i % 3], tuple(p), tuple(d), 0.1)
+               for (i, p, d) in zip(range(40), 30 + rng.random((40,2))*140,
+                                    rng.choice([-1,1], (40,2)))]
+    for creep in sprites:
+        creep.update(20)
+    swarm = creeps.CreepSwarm.from_creeps(sprites)
+
+    def pixels(draw):
+        display.fill((150,150,80))
+        rects = draw()
+        return pygame.surfarray.array3d(display), rects
+
+    expected, _ = pixels(lambda: [c.blitme() for c in sprites])
+    batched, rects = pixels(lambda: creeps.blit_creeps(display, sprites))
+    assert (batched == expected).all()
+    swarmed, swarm_rects = pixels(lambda: swarm.draw(display))
+    assert (swarmed == expected).all()
+    assert swarm_rects == rects and len(rects) == 40
+    background = pygame.Surface((200,200))
+    background.fill((150,150,80))
+    dirty = creeps.draw_frame(display, background, swarm, [])
+    assert dirty == rects
+    swarm.update(20)
+    dirty = creeps.draw_frame(display, background, swarm, dirty)
+    assert (pygame.surfarray.array3d(display) == pixels(
+        lambda: swarm.draw(display))[0]).all()
+
+def test_creep_simulation():
+    runs = [creeps.CreepSimulation((400,400), 500, seed=7) for i in range(3)]
+    runs[0].step(300)
+    runs[1].step(300)
+    assert (runs[0].swarm.pos == runs[1].swarm.pos).all()
+    assert (runs[0].swarm.octant == runs[1].swarm.octant).all()
+    # Uneven frames add up to the same whole ticks
+    frames = [17, 23, 20, 31, 9] * 60
+    assert sum(runs[2].advance(t) for t in frames) == 300 == runs[2].ticks
+    assert runs[2].lag == 0 and runs[2].time() == 6000
+    assert (runs[2].swarm.pos == runs[0].swarm.pos).all()
+    other = creeps.CreepSimulation((400,400), 500, seed=8)
+    other.step(300)
+    assert not (other.swarm.pos == runs[0].swarm.pos).all()
+    # Slow frames don't snowball
+    assert other.advance(1000, max_ticks=10) == 10 and other.lag == 20
+
+def test_seeded_creeps(display):
+    sprites = [creeps.Creep(display, 'graycreep.png', (100,100), (1,0), 0.1,
+                            rng=random.Random(5)) for i in range(2)]
+    for step in range(500):
+        for creep in sprites:
+            creep.update(20)
+    assert tuple(sprites[0].pos) == tuple(sprites[1].pos)
+
+def test_creep_allocations(display):
+    # Trace from the start, so every object the creeps hold was seen
+    # being allocated
+    n = 10**4
+    tracemalloc.start()
+    try:
+        rng = np.random.default_rng(5)
+        sprites = [creeps.Creep(display, creeps.CREEP_FILENAMES[i % 3], p, d,
+                                0.1, rng=random.Random(i))
+                   for (i, p, d) in zip(range(n),
+                                        (rng.random((n,2))*200).tolist(),
+                                        rng.choice([-1,1], (n,2)).tolist())]
+        updates = [lambda creep=creep: creep.update(20) for creep in sprites]
+        stats = creeps.allocations(updates, ticks=10, warmup=10)
+    finally:
+        tracemalloc.stop()
+    # Only the few creeps turning in a tick allocate anything, and free
+    # it again
+    assert stats['bytes'] < 20*n
+    # Nothing is kept.  Floats come and go (creeps at a wall hold its int
+    # bound, and the float free list grows and shrinks), which is well
+    # under a byte per creep per tick.
+    assert abs(stats['retained']) < n/10
+
+def test_point_grid_within():
+    rng = np.random.default_rng(6)
+    pts = rng.random((500,2))*10
+    grid = spatial.PointGrid(pts, 0.7)
+    for (x, radius) in [((5,5), 1.0), ((0,0), 2.5), ((-3,12), 4.0),
+                        ((20,20), 1.0)]:
+        d = np.hypot(*(pts - x).T)
+        assert list(grid.within(x, radius)) == list(np.flatnonzero(d <= radius))
+
+def test_creep_swarm_queries():
+    rng = np.random.default_rng(7)
+    n = 400
+    sizes = np.array([[[15,15], [21,21]]*4, [[20,10], [28,28]]*4])
+    swarm = creeps.CreepSwarm((300,300), rng.random((n,2))*300,
+                              rng.choice([-1,1], (n,2)), 0.1,
+                              rng.integers(2, size=n), sizes, rng)
+    swarm.update(20)
+    gap = np.abs(swarm.pos[:,None] - swarm.pos[None])
+    upper = np.triu(np.ones((n,n), dtype=bool), 1)
+    d = np.hypot(gap[...,0], gap[...,1])
+
+    a, b = swarm.close_pairs(12)
+    assert list(zip(a, b)) == list(zip(*np.nonzero(upper & (d <= 12))))
+    s = swarm.sizes()
+    overlap = (2*gap < s[:,None] + s[None]).all(axis=2)
+    a, b = swarm.collisions()
+    assert len(a) and list(zip(a, b)) == list(zip(*np.nonzero(upper & overlap)))
+    assert list(swarm.neighbours(3, 30)) == \
+        [j for j in np.flatnonzero(d[3] <= 30) if j != 3]
+    # The grid follows the creeps
+    grid = swarm.grid()
+    assert swarm.grid() is grid
+    swarm.update(20)
+    assert swarm.grid() is not grid
+    # and the positions, however they change
+    near = set(swarm.neighbours(3, 30))
+    swarm.pos = swarm.pos[::-1]
+    assert set(swarm.neighbours(n-1-3, 30)) == set(n-1-j for j in near)
+    grid = swarm.grid()
+    swarm.pos[0] = swarm.pos[1]
+    swarm.invalidate()
+    assert 0 in swarm.neighbours(1, 1)
+
+def test_profiler(display, tmp_path):
+    profiler = profiling.Profiler(window=5)
+    # Nothing is recorded while it is off
+    with profiler.stage('update'):
+        pass
+    profiler.frame(100)
+    assert profiler.stage('update') is profiling.NULL_TIMER
+    assert profiler.stats() == {'stages': {}, 'missed_frames': 0}
+
+    @profiler.timed('geometry')
+    def geometry_stage(x):
+        return 2*x
+
+    profiler.toggle()
+    assert profiler.overlay
+    for i in range(8):
+        with profiler.stage('update'):
+            pass
+        assert geometry_stage(i) == 2*i
+        profiler.frame(20 if i % 2 else 50)
+    stats = profiler.stats()
+    assert list(stats['stages']) == ['update', 'geometry']
+    assert stats['stages']['update']['count'] == 8
+    assert len(profiler.timers['update'].samples) == 5
+    assert stats['missed_frames'] == 4
+    assert profiler.histogram('geometry')[0].sum() == 5
+
+    rect = profiler.draw_overlay(display)
+    assert rect.w > 0 and rect.h > 0
+    profiler.start_cprofile()
+    geometry_stage(1)
+    profiler.stop_cprofile(str(tmp_path/'calls.prof'))
+    assert 'geometry_stage' in str(
+        pstats.Stats(str(tmp_path/'calls.prof')).stats)
+    profiler.dump(str(tmp_path/'stages.json'))
+    with open(str(tmp_path/'stages.json')) as f:
+        dumped = json.load(f)
+    assert dumped['stages']['update']['count'] == 8
+    assert sum(dumped['histograms']['update']['counts']) == 5
@@ -0,0 +1,79 @@
+"""The curve the drawbot draws: the path of the arm head over the disc as
+both of them turn.
+"""
+import numpy as np
+
+import geometry
+import mechanism
+
+
+class AngleSchedule(object):
+    """Integrates an angular velocity schedule (in degrees per second) into
+    angles, one chunk of sample times at a time.  The schedule is either a
+    constant or a function of an array of times giving an array of
+    velocities."""
+    def __init__(self, velocity, angle=0.0):
+        self.velocity = velocity
+        self.angle = angle
+        self.last_t = None
+        self.last_velocity = None
+
+    def angles(self, t):
+        """Angles at the (increasing) sample times `t`, which continue on from
+        the times of the previous call"""
+        if not callable(self.velocity):
+            if self.last_t is None: self.last_t = t[0]
+            angles = self.angle + self.velocity*(t - self.last_t)
+        else:
+            # Trapezoid rule, carrying on from the end of the last chunk
+            velocity = self.velocity(t)
+            if self.last_t is None:
+                self.last_t, self.last_velocity = t[0], velocity[0]
+            steps = np.diff(t, prepend=self.last_t)
+            means = (velocity + np.concatenate(
+                [[self.last_velocity], velocity[:-1]]))/2
+            angles = self.angle + np.cumsum(means*steps)
+            self.last_velocity = velocity[-1]
+        self.last_t = t[-1]
+        self.angle = angles[-1]
+        return angles
+
+
+
+def trace(disc_velocity, arm_velocity, duration, dt=0.01, model=None,
+          drawing=None, chunk_size=65536):
+    """Generate the pen path drawn on the disc while the disc and the arm
+    turn with the given angular velocity schedules (see AngleSchedule),
+    sampled every `dt` seconds for `duration` seconds.
+
+    The path is in the disc's own (rotating) frame, starting from the angles
+    and dimensions of `model`, a MechanismModel, with the angle directions of
+    `drawing`, a MechanismDrawing.  It is yielded as consecutive (n,2) arrays
+    of at most `chunk_size` points, so memory stays bounded however long the
+    drawing is."""
+    if model is None: model = mechanism.MechanismModel()
+    if drawing is None: drawing = mechanism.MechanismDrawing(model)
+    disc = AngleSchedule(disc_velocity, model.get_disc_angle())
+    arm = AngleSchedule(arm_velocity, model.get_arm_angle())
+
+    n_points = int(round(duration/dt)) + 1
+    for start in range(0, n_points, chunk_size):
+        t = dt*np.arange(start, min(start + chunk_size, n_points))
+        yield pen_positions(disc.angles(t), arm.angles(t),
+                            model.get_arm_length(), model.get_disc_radius(),
+                            drawing)
+
+def pen_positions(disc_angle, arm_angle, arm_length, disc_radius,
+                  drawing=None):
+    """Positions of the arm head in the disc's (rotating) frame for arrays of
+    mechanism parameters, as in mechanism.evaluate_configs"""
+    if drawing is None: drawing = mechanism.MechanismDrawing(None)
+    head = mechanism.evaluate_configs(
+        disc_angle, arm_angle, arm_length, disc_radius,
+        geometry=False, drawing=drawing).head
+
+    # A point p on the disc is drawn at the world position
+    # transform(p, angle=world_disc_angle), so undo that
+    world_disc_angle = drawing.disc_angle_direction*np.asarray(disc_angle)
+    return geometry.batch_transform(
+        head[...,None,:], angle=-world_disc_angle)[...,0,:]
@@ -0,0 +1,182 @@
+"""Ordering of paths for a pen plotter, to cut down the distance travelled
+with the pen up between them.
+
+Each path can be drawn from either end.  A plan is an `order` of the paths
+and, for each path, whether it is `flipped` (drawn from its tail).  Plans are
+built nearest-neighbour first, then improved with 2-opt moves, which reverse
+a run of the plan.  Both only look at nearby path ends (through a
+spatial.PointGrid), so they scale to hundreds of thousands of paths.
+"""
+import numpy as np
+
+import spatial
+
+
+def endpoints(paths):
+    """(heads, tails): the first and last points of each path"""
+    heads = np.array([path[0] for path in paths], dtype=float).reshape(-1,2)
+    tails = np.array([path[-1] for path in paths], dtype=float).reshape(-1,2)
+    return heads, tails
+
+def pen_up_distance(heads, tails, order, flipped, start=[0,0]):
+    """Distance travelled with the pen up by a plan, starting at `start`"""
+    starts = np.where(flipped[:,None], tails, heads)[order]
+    ends = np.where(flipped[:,None], heads, tails)[order]
+    previous = np.vstack([np.reshape(start, (1,2)), ends[:-1]])
+    return float(np.hypot(*(starts - previous).T).sum())
+
+def _cell_size(pts, per_cell=2.0):
+    """Grid cell size giving about `per_cell` points per occupied cell"""
+    if not len(pts):
+        return 1.0
+    extent = np.ptp(pts, axis=0).max()
+    cell_size = max(extent*np.sqrt(per_cell/len(pts)), 1e-9)
+    # Clustered points crowd into few cells, so shrink the cells to suit
+    for _ in range(3):
+        cells = np.floor(pts/cell_size).astype(np.int64)
+        occupied = len(np.unique(cells[:,0]*(2**31) + cells[:,1]))
+        crowding = len(pts)/(occupied*per_cell)
+        if crowding < 2:
+            break
+        cell_size /= np.sqrt(crowding)
+    return cell_size
+
+def nearest_neighbour(heads, tails, start=[0,0]):
+    """Plan which always goes to the nearest end of a path not drawn yet"""
+    n = len(heads)
+    # End e is the head of path e, or for e >= n the tail of path e - n
+    ends = np.concatenate([heads, tails])
+    cell_size = _cell_size(ends)
+    order = np.zeros(n, dtype=int)
+    flipped = np.zeros(n, dtype=bool)
+    drawn = np.zeros(n, dtype=bool)
+    here = np.asarray(start, dtype=float)
+
+    def build(cell_size):
+        # Grid over the ends of the paths not drawn yet
+        index = np.flatnonzero(~np.concatenate([drawn, drawn]))
+        return spatial.PointGrid(ends[index], cell_size), index
+
+    grid, index = build(cell_size)
+    active = np.ones(len(index), dtype=bool)
+    remaining = n
+    for k in range(n):
+        e = index[grid.nearest(here, active)]
+        path = e % n
+        order[k] = path
+        flipped[path] = e >= n
+        drawn[path] = True
+        here = heads[path] if e >= n else tails[path]
+        remaining -= 1
+        # Searches slow down as the grid empties, so rebuild it coarser
+        if remaining and 2*remaining < len(index)/4:
+            cell_size *= 2
+            grid, index = build(cell_size)
+            active = np.ones(len(index), dtype=bool)
+        else:
+            active[np.searchsorted(index, [path, path + n])] = False
+    return order, flipped
+
+def neighbour_lists(pts, k=6):
+    """For each point, the indices of (up to) its k nearest other points"""
+    grid = spatial.PointGrid(pts, _cell_size(pts, per_cell=k/3.))
+    a, b = grid.pairs(half=False)
+    d = ((pts[a] - pts[b])**2).sum(axis=1)
+    ranked = np.lexsort((d, a))
+    a, b = a[ranked], b[ranked]
+    firsts = np.searchsorted(a, np.arange(len(pts)))
+    rank = np.arange(len(a)) - firsts[a]
+    keep = rank < k
+    lists = [[] for _ in range(len(pts))]
+    for (i, j) in zip(a[keep].tolist(), b[keep].tolist()):
+        lists[i].append(j)
+    return lists
+
+def two_opt(heads, tails, order, flipped, start=[0,0], k=6, passes=3):
+    """Improve a plan in place by reversing runs of it (which also flips the
+    direction of each path in the run) while that shortens the pen-up
+    travel.  Only moves joining an end to one of its k nearest ends are
+    tried."""
+    n = len(order)
+    if n < 2:
+        return order, flipped
+    ends = np.concatenate([heads, tails])
+    near = neighbour_lists(ends, k)
+    xy = ends.tolist()
+    start = [float(start[0]), float(start[1])]
+    near_start = np.argsort(np.hypot(*(ends - start).T))[:k].tolist()
+    position = np.empty(n, dtype=int)
+    position[order] = np.arange(n)
+
+    def dist(p, q):
+        return ((p[0] - q[0])**2 + (p[1] - q[1])**2)**0.5
+
+    def first(i):
+        # Where the path at position i starts, as an end index
+        path = int(order[i])
+        return path + n if flipped[path] else path
+
+    def last(i):
+        path = int(order[i])
+        return path if flipped[path] else path + n
+
+    def before(i):
+        return start if i == 0 else xy[last(i - 1)]
+
+    def gain(i, j):
+        # Shortening of the travel from reversing positions i..j
+        a = before(i)
+        old = dist(a, xy[first(i)])
+        new = dist(a, xy[last(j)])
+        if j + 1 < n:
+            b = xy[first(j + 1)]
+            old += dist(xy[last(j)], b)
+            new += dist(xy[first(i)], b)
+        return old - new
+
+    def reverse(i, j):
+        run = order[i:j+1][::-1].copy()
+        order[i:j+1] = run
+        flipped[run] ^= True
+        position[run] = np.arange(i, j + 1)
+
+    for _ in range(passes):
+        improved = False
+        for i in range(n):
+            # Join the end before position i to the last end of a later run
+            candidates = near_start if i == 0 else near[last(i - 1)]
+            for c in candidates:
+                j = int(position[c % n])
+                if j >= i and last(j) == c and gain(i, j) > 1e-12:
+                    reverse(i, j)
+                    improved = True
+                    break
+            # Join the first end of an earlier run to the one at position i
+            if i == 0:
+                continue
+            for c in near[first(i)]:
+                h = int(position[c % n])
+                if h < i and first(h) == c and gain(h, i - 1) > 1e-12:
+                    reverse(h, i - 1)
+                    improved = True
+                    break
+        if not improved:
+            break
+    return order, flipped
+
+def optimize(paths, start=[0,0], k=6, passes=3):
+    """Plan the order and direction of the paths, returning the reordered
+    paths and the pen-up distances before and after"""
+    if not len(paths):
+        return [], {'before': 0.0, 'nearest_neighbour': 0.0, 'after': 0.0}
+    heads, tails = endpoints(paths)
+    unchanged = np.arange(len(paths))
+    report = {'before': pen_up_distance(
+        heads, tails, unchanged, np.zeros(len(paths), dtype=bool), start)}
+    order, flipped = nearest_neighbour(heads, tails, start)
+    report['nearest_neighbour'] = pen_up_distance(
+        heads, tails, order, flipped, start)
+    order, flipped = two_opt(heads, tails, order, flipped, start, k, passes)
+    report['after'] = pen_up_distance(heads, tails, order, flipped, start)
+    ordered = [paths[i][::-1] if flipped[i] else paths[i] for i in order]
+    return ordered, report
@@ -1,15 +1,37 @@
 ########################################################################
+import numbers
 import operator
 import math
+
+import numpy as np
+
+# Types taken as plain numbers by the operators' fast paths
+_SCALARS = frozenset([int, float, np.float64, np.int64])
+
+# (cos, sin) of the multiples of 45 degrees (up to a full turn either
+# way), exactly, so rotating by them needs no trig.  Only int angles are
+# looked up, as hashing a float costs about as much as the trig.
+_HALF_ROOT_2 = math.sqrt(0.5)
+_OCTANT_COS_SIN = [
+    (1.0, 0.0), (_HALF_ROOT_2, _HALF_ROOT_2),
+    (0.0, 1.0), (-_HALF_ROOT_2, _HALF_ROOT_2),
+    (-1.0, 0.0), (-_HALF_ROOT_2, -_HALF_ROOT_2),
+    (0.0, -1.0), (_HALF_ROOT_2, -_HALF_ROOT_2)]
+_EXACT_COS_SIN = dict(
+    (45*k, _OCTANT_COS_SIN[k % 8]) for k in range(-8, 9))
  
 class vec2d(object):
     """2d vector class, supports vector and scalar operators,
        and also provides a bunch of high level functions
        """
-    __slots__ = ['x', 'y']
+    # The angle is cached as (x, y, angle), and only used while x and y
+    # are still the very same objects (so -0.0 is never taken for 0.0).
+    # That suits direction vectors, whose angle is read far more often
+    # than they turn.
+    __slots__ = ['x', 'y', '_angle_cache']
  
     def __init__(self, x_or_pair, y = None):
-        if y == None:
+        if y is None:
             self.x = x_or_pair[0]
             self.y = x_or_pair[1]
         else:
@@ -56,11 +78,18 @@ class vec2d(object):
         return self.x or self.y
  
     # Generic operator handlers
+    #
+    # The hot operators check for the common cases first, by exact type:
+    # another vec2d, then a plain number, and only then anything indexable.
     def _o2(self, other, f):
         "Any two-operator operation where the left operand is a vec2d"
-        if isinstance(other, vec2d):
+        cls = other.__class__
+        if cls is vec2d:
             return vec2d(f(self.x, other.x),
                          f(self.y, other.y))
+        elif cls in _SCALARS:
+            return vec2d(f(self.x, other),
+                         f(self.y, other))
         elif (hasattr(other, "__getitem__")):
             return vec2d(f(self.x, other[0]),
                          f(self.y, other[1]))
@@ -70,7 +99,10 @@ class vec2d(object):
  
     def _r_o2(self, other, f):
         "Any two-operator operation where the right operand is a vec2d"
-        if (hasattr(other, "__getitem__")):
+        if other.__class__ in _SCALARS:
+            return vec2d(f(other, self.x),
+                         f(other, self.y))
+        elif (hasattr(other, "__getitem__")):
             return vec2d(f(other[0], self.x),
                          f(other[1], self.y))
         else:
@@ -79,7 +111,11 @@ class vec2d(object):
  
     def _io(self, other, f):
         "inplace operator"
-        if (hasattr(other, "__getitem__")):
+        cls = other.__class__
+        if cls is vec2d:
+            self.x = f(self.x, other.x)
+            self.y = f(self.y, other.y)
+        elif cls not in _SCALARS and hasattr(other, "__getitem__"):
             self.x = f(self.x, other[0])
             self.y = f(self.y, other[1])
         else:
@@ -89,8 +125,11 @@ class vec2d(object):
  
     # Addition
     def __add__(self, other):
-        if isinstance(other, vec2d):
+        cls = other.__class__
+        if cls is vec2d:
             return vec2d(self.x + other.x, self.y + other.y)
+        elif cls in _SCALARS:
+            return vec2d(self.x + other, self.y + other)
         elif hasattr(other, "__getitem__"):
             return vec2d(self.x + other[0], self.y + other[1])
         else:
@@ -98,9 +137,13 @@ class vec2d(object):
     __radd__ = __add__
     
     def __iadd__(self, other):
-        if isinstance(other, vec2d):
+        cls = other.__class__
+        if cls is vec2d:
             self.x += other.x
             self.y += other.y
+        elif cls in _SCALARS:
+            self.x += other
+            self.y += other
         elif hasattr(other, "__getitem__"):
             self.x += other[0]
             self.y += other[1]
@@ -111,23 +154,31 @@ class vec2d(object):
  
     # Subtraction
     def __sub__(self, other):
-        if isinstance(other, vec2d):
+        cls = other.__class__
+        if cls is vec2d:
             return vec2d(self.x - other.x, self.y - other.y)
+        elif cls in _SCALARS:
+            return vec2d(self.x - other, self.y - other)
         elif (hasattr(other, "__getitem__")):
             return vec2d(self.x - other[0], self.y - other[1])
         else:
             return vec2d(self.x - other, self.y - other)
     def __rsub__(self, other):
-        if isinstance(other, vec2d):
-            return vec2d(other.x - self.x, other.y - self.y)
+        cls = other.__class__
+        if cls in _SCALARS:
+            return vec2d(other - self.x, other - self.y)
         if (hasattr(other, "__getitem__")):
             return vec2d(other[0] - self.x, other[1] - self.y)
         else:
             return vec2d(other - self.x, other - self.y)
     def __isub__(self, other):
-        if isinstance(other, vec2d):
+        cls = other.__class__
+        if cls is vec2d:
             self.x -= other.x
             self.y -= other.y
+        elif cls in _SCALARS:
+            self.x -= other
+            self.y -= other
         elif (hasattr(other, "__getitem__")):
             self.x -= other[0]
             self.y -= other[1]
@@ -138,7 +189,10 @@ class vec2d(object):
  
     # Multiplication
     def __mul__(self, other):
-        if isinstance(other, vec2d):
+        cls = other.__class__
+        if cls in _SCALARS:
+            return vec2d(self.x*other, self.y*other)
+        elif cls is vec2d:
             return vec2d(self.x*other.x, self.y*other.y)
         if (hasattr(other, "__getitem__")):
             return vec2d(self.x*other[0], self.y*other[1])
@@ -147,7 +201,11 @@ class vec2d(object):
     __rmul__ = __mul__
     
     def __imul__(self, other):
-        if isinstance(other, vec2d):
+        cls = other.__class__
+        if cls in _SCALARS:
+            self.x *= other
+            self.y *= other
+        elif cls is vec2d:
             self.x *= other.x
             self.y *= other.y
         elif (hasattr(other, "__getitem__")):
@@ -174,11 +232,17 @@ class vec2d(object):
         return self._io(other, operator.floordiv)
  
     def __truediv__(self, other):
+        if other.__class__ in _SCALARS:
+            return vec2d(self.x/other, self.y/other)
         return self._o2(other, operator.truediv)
     def __rtruediv__(self, other):
         return self._r_o2(other, operator.truediv)
     def __itruediv__(self, other):
-        return self._io(other, operator.floordiv)
+        if other.__class__ in _SCALARS:
+            self.x /= other
+            self.y /= other
+            return self
+        return self._io(other, operator.truediv)
  
     # Modulo
     def __mod__(self, other):
@@ -246,26 +310,43 @@ class vec2d(object):
     length = property(get_length, __setlength, None, "gets or sets the magnitude of the vector")
        
     def rotate(self, angle_degrees):
-        radians = math.radians(angle_degrees)
-        cos = math.cos(radians)
-        sin = math.sin(radians)
+        if type(angle_degrees) is int and angle_degrees in _EXACT_COS_SIN:
+            cos, sin = _EXACT_COS_SIN[angle_degrees]
+        else:
+            radians = math.radians(angle_degrees)
+            cos = math.cos(radians)
+            sin = math.sin(radians)
         x = self.x*cos - self.y*sin
         y = self.x*sin + self.y*cos
         self.x = x
         self.y = y
  
     def rotated(self, angle_degrees):
-        radians = math.radians(angle_degrees)
-        cos = math.cos(radians)
-        sin = math.sin(radians)
+        if type(angle_degrees) is int and angle_degrees in _EXACT_COS_SIN:
+            cos, sin = _EXACT_COS_SIN[angle_degrees]
+        else:
+            radians = math.radians(angle_degrees)
+            cos = math.cos(radians)
+            sin = math.sin(radians)
         x = self.x*cos - self.y*sin
         y = self.x*sin + self.y*cos
         return vec2d(x, y)
     
     def get_angle(self):
-        if (self.get_length_sqrd() == 0):
-            return 0
-        return math.degrees(math.atan2(self.y, self.x))
+        x = self.x
+        y = self.y
+        try:
+            cached_x, cached_y, angle = self._angle_cache
+            if cached_x is x and cached_y is y:
+                return angle
+        except AttributeError:
+            pass
+        if x == 0 and y == 0:
+            angle = 0
+        else:
+            angle = math.degrees(math.atan2(y, x))
+        self._angle_cache = (x, y, angle)
+        return angle
     def __setangle(self, angle_degrees):
         self.x = self.length
         self.y = 0
@@ -328,6 +409,241 @@ class vec2d(object):
     def __setstate__(self, dict):
         self.x, self.y = dict
         
+class vec2d_ref(vec2d):
+    """vec2d that is a view of one vector of a vec2d_array: reading and
+       writing its components reads and writes the array
+       """
+    __slots__ = ['_data', '_index']
+
+    def __init__(self, array, index):
+        self._data = array.data
+        self._index = index
+
+    def _get_x(self):
+        return self._data[self._index, 0]
+    def _set_x(self, value):
+        self._data[self._index, 0] = value
+    x = property(_get_x, _set_x)
+
+    def _get_y(self):
+        return self._data[self._index, 1]
+    def _set_y(self, value):
+        self._data[self._index, 1] = value
+    y = property(_get_y, _set_y)
+
+    def __reduce__(self):
+        # Pickles (and copies) as an independent vec2d
+        return (vec2d, (self.x, self.y))
+
+ 
+class vec2d_array(object):
+    """N 2d vectors in one (N,2) float64 array, with the vec2d methods
+       done on all of them at once.  Indexing gives vec2d_ref views of
+       single vectors (or vec2d_array views of slices), so code can move
+       from vec2d to vec2d_array a bit at a time.
+       """
+    __slots__ = ['data']
+ 
+    def __init__(self, vectors_or_n):
+        if isinstance(vectors_or_n, numbers.Integral):
+            self.data = np.zeros((int(vectors_or_n), 2))
+        elif isinstance(vectors_or_n, vec2d_array):
+            self.data = vectors_or_n.data.copy()
+        else:
+            self.data = np.array(
+                [tuple(v) for v in vectors_or_n]
+                if not isinstance(vectors_or_n, np.ndarray) else vectors_or_n,
+                dtype=float).reshape(-1, 2)
+
+    @classmethod
+    def view(cls, data):
+        "vec2d_array sharing the (N,2) float64 array data"
+        array = cls.__new__(cls)
+        array.data = data
+        return array
+ 
+    def __len__(self):
+        return len(self.data)
+ 
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return vec2d_array.view(self.data[key])
+        if key < 0:
+            key += len(self.data)
+        if not 0 <= key < len(self.data):
+            raise IndexError("Invalid subscript "+str(key)+" to vec2d_array")
+        return vec2d_ref(self, key)
+ 
+    def __setitem__(self, key, value):
+        self.data[key] = _values(value)
+ 
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield vec2d_ref(self, i)
+ 
+    def __repr__(self):
+        return 'vec2d_array(%s)' % self.data.tolist()
+ 
+    def to_vec2ds(self):
+        "The vectors as a list of (independent) vec2d"
+        return [vec2d(x, y) for (x, y) in self.data.tolist()]
+ 
+    def get_x(self):
+        return self.data[:, 0]
+    def set_x(self, value):
+        self.data[:, 0] = value
+    x = property(get_x, set_x, None, "gets or sets the x components")
+ 
+    def get_y(self):
+        return self.data[:, 1]
+    def set_y(self, value):
+        self.data[:, 1] = value
+    y = property(get_y, set_y, None, "gets or sets the y components")
+ 
+    # Operators, with vec2d_arrays, (N,2) arrays, vectors, N scalars or
+    # a scalar
+    def _o2(self, other, f):
+        return vec2d_array.view(f(self.data, _values(other, len(self))))
+ 
+    def _r_o2(self, other, f):
+        return vec2d_array.view(f(_values(other, len(self)), self.data))
+ 
+    def _io(self, other, f):
+        f(self.data, _values(other, len(self)), out=self.data)
+        return self
+ 
+    def __add__(self, other):
+        return self._o2(other, np.add)
+    __radd__ = __add__
+    def __iadd__(self, other):
+        return self._io(other, np.add)
+ 
+    def __sub__(self, other):
+        return self._o2(other, np.subtract)
+    def __rsub__(self, other):
+        return self._r_o2(other, np.subtract)
+    def __isub__(self, other):
+        return self._io(other, np.subtract)
+ 
+    def __mul__(self, other):
+        return self._o2(other, np.multiply)
+    __rmul__ = __mul__
+    def __imul__(self, other):
+        return self._io(other, np.multiply)
+ 
+    def __truediv__(self, other):
+        return self._o2(other, np.true_divide)
+    def __rtruediv__(self, other):
+        return self._r_o2(other, np.true_divide)
+    def __itruediv__(self, other):
+        return self._io(other, np.true_divide)
+ 
+    def __neg__(self):
+        return vec2d_array.view(-self.data)
+ 
+    def __abs__(self):
+        return vec2d_array.view(np.abs(self.data))
+ 
+    # vectory functions
+    def get_length_sqrd(self):
+        return (self.data**2).sum(axis=1)
+ 
+    def get_length(self):
+        return np.hypot(self.data[:, 0], self.data[:, 1])
+    def __setlength(self, value):
+        self.data *= (value/self.get_length())[:, None]
+    length = property(get_length, __setlength, None, "gets or sets the magnitudes of the vectors")
+ 
+    def rotate(self, angle_degrees):
+        self.data[:] = self.rotated(angle_degrees).data
+ 
+    def rotated(self, angle_degrees):
+        radians = np.radians(angle_degrees)
+        cos = np.cos(radians)
+        sin = np.sin(radians)
+        x, y = self.data[:, 0], self.data[:, 1]
+        return vec2d_array.view(
+            np.stack([x*cos - y*sin, x*sin + y*cos], axis=-1))
+ 
+    def get_angle(self):
+        return np.degrees(np.arctan2(self.data[:, 1], self.data[:, 0]))
+    def __setangle(self, angle_degrees):
+        length = self.get_length()
+        self.data[:, 0] = length
+        self.data[:, 1] = 0
+        self.rotate(angle_degrees)
+    angle = property(get_angle, __setangle, None, "gets or sets the angles of the vectors")
+ 
+    def get_angle_between(self, other):
+        return np.degrees(np.arctan2(self.cross(other), self.dot(other)))
+ 
+    def normalized(self):
+        length = self.get_length()
+        length[length == 0] = 1
+        return vec2d_array.view(self.data/length[:, None])
+ 
+    def normalize_return_length(self):
+        length = self.get_length()
+        self.data /= np.where(length == 0, 1, length)[:, None]
+        return length
+ 
+    def perpendicular(self):
+        return vec2d_array.view(np.stack([-self.data[:, 1], self.data[:, 0]], axis=-1))
+ 
+    def perpendicular_normal(self):
+        return self.perpendicular().normalized()
+ 
+    def dot(self, other):
+        return (self.data*_values(other, len(self))).sum(axis=1)
+ 
+    def get_distance(self, other):
+        return np.sqrt(self.get_dist_sqrd(other))
+ 
+    def get_dist_sqrd(self, other):
+        return ((self.data - _values(other, len(self)))**2).sum(axis=1)
+ 
+    def projection(self, other):
+        other = _values(other, len(self))
+        other_length_sqrd = (other**2).sum(axis=-1)
+        scale = self.dot(other)/other_length_sqrd
+        return vec2d_array.view(other*scale[:, None])
+ 
+    def cross(self, other):
+        other = _values(other, len(self))
+        return self.data[:, 0]*other[..., 1] - self.data[:, 1]*other[..., 0]
+ 
+    def interpolate_to(self, other, range):
+        range = np.asarray(range, dtype=float)
+        if range.ndim == 1:
+            range = range[:, None]
+        return vec2d_array.view(
+            self.data + (_values(other, len(self)) - self.data)*range)
+ 
+    def convert_to_basis(self, x_vector, y_vector):
+        x_vector = _values(x_vector, len(self))
+        y_vector = _values(y_vector, len(self))
+        return vec2d_array.view(np.stack([
+            self.dot(x_vector)/(x_vector**2).sum(axis=-1),
+            self.dot(y_vector)/(y_vector**2).sum(axis=-1)], axis=-1))
+ 
+    def __getstate__(self):
+        return self.data
+ 
+    def __setstate__(self, data):
+        self.data = data
+ 
+def _values(other, n=None):
+    "other as something to broadcast against an (n,2) array of vectors"
+    if isinstance(other, vec2d_array):
+        return other.data
+    if isinstance(other, vec2d):
+        return np.array([other.x, other.y], dtype=float)
+    values = np.asarray(other, dtype=float)
+    if values.ndim == 1 and len(values) == n and n != 2:
+        # One scalar per vector (though two values are taken as a vector)
+        return values[:, None]
+    return values
+ 
 ########################################################################
 ## Unit Testing                                                       ##
 ########################################################################
@@ -404,6 +720,11 @@ if __name__ == "__main__":
             v2.rotate(v2.get_angle_between(v))
             angle = v.get_angle_between(v2)
             self.assertAlmostEquals(v.get_angle_between(v2), 0)  
+            # The cached angle follows the sign of zero
+            v3 = vec2d(-1.0, 0.0)
+            self.assertEqual(v3.angle, 180)
+            v3.y = -0.0
+            self.assertEqual(v3.angle, -180)
  
         def testHighLevel(self):
             basis0 = vec2d(5.0, 0)
@@ -450,6 +771,98 @@ if __name__ == "__main__":
             self.assertEquals(testvec, loaded_vec)
     
     ####################################################################
-    unittest.main()
+    class UnitTestVec2DArray(unittest.TestCase):
+ 
+        def setUp(self):
+            self.vecs = [vec2d(3, 4), vec2d(-1, 2.5), vec2d(0, -2)]
+            self.array = vec2d_array(self.vecs)
+ 
+        def assertMatches(self, array_result, vec_results):
+            self.assertEqual(len(array_result), len(vec_results))
+            for (a, v) in zip(array_result, vec_results):
+                self.assert_(abs(vec2d(a) - v).get_length() < 1e-9
+                             if isinstance(v, vec2d) else abs(a - v) < 1e-9)
+ 
+        def testViews(self):
+            ref = self.array[1]
+            self.assert_(isinstance(ref, vec2d))
+            self.assertEqual(ref, (-1, 2.5))
+            ref += (1, 1)
+            ref.rotate(90)
+            self.assertMatches(self.array.data[1:2], [vec2d(-3.5, 0)])
+            self.array.data[2] = (5, 6)
+            self.assertEqual(self.array[-1], vec2d(5, 6))
+            part = self.array[1:]
+            part.x = 7
+            self.assertEqual(self.array[2].x, 7)
+            self.assertEqual(pickle.loads(pickle.dumps(ref)), ref)
+            self.assertEqual(type(pickle.loads(pickle.dumps(ref))), vec2d)
+
+        def testCounts(self):
+            for n in [3, np.int64(3), np.int32(3), np.uint8(3)]:
+                self.assertEqual(vec2d_array(n).data.shape, (3, 2))
+ 
+        def testMath(self):
+            a = self.array
+            self.assertMatches(a + 1, [v + 1 for v in self.vecs])
+            self.assertMatches(a - (1, 2), [v - (1, 2) for v in self.vecs])
+            self.assertMatches(2 * a, [v * 2 for v in self.vecs])
+            self.assertMatches(a / [1, 2, 4],
+                               [v / d for (v, d) in zip(self.vecs, [1, 2, 4])])
+            self.assertMatches(-a, [-v for v in self.vecs])
+            a *= a
+            self.assertMatches(a, [v * v for v in self.vecs])
+ 
+        def testVectorFunctions(self):
+            a = self.array
+            other = vec2d(2, -1)
+            for name in ['get_length', 'get_length_sqrd', 'get_angle',
+                         'normalized', 'perpendicular', 'perpendicular_normal']:
+                self.assertMatches(getattr(a, name)(),
+                                   [getattr(v, name)() for v in self.vecs])
+            for name in ['dot', 'cross', 'projection', 'get_distance',
+                         'get_dist_sqrd', 'get_angle_between']:
+                self.assertMatches(getattr(a, name)(other),
+                                   [getattr(v, name)(other) for v in self.vecs])
+            self.assertMatches(a.rotated(30), [v.rotated(30) for v in self.vecs])
+            self.assertMatches(a.interpolate_to(other, .25),
+                               [v.interpolate_to(other, .25) for v in self.vecs])
+            basis = (vec2d(5.0, 0), vec2d(0, .5))
+            self.assertMatches(a.convert_to_basis(*basis),
+                               [v.convert_to_basis(*basis) for v in self.vecs])
+            a.rotate([90, 180, -45])
+            self.assertMatches(a, [v.rotated(d) for (v, d) in
+                                   zip(self.vecs, [90, 180, -45])])
+ 
+    ####################################################################
+    BENCHMARKS = [
+        'v + w', 'v + 2.0', 'v + t', 'u += w', 'u += 2.0',
+        'v - w', 'v - 2.0', 'u -= w',
+        'v * w', 'v * 2.0', '2.0 * v', 'u *= 1.0',
+        'v / w', 'v / 2.0', 'u /= 1.0',
+        '-v', 'v == w',
+        'v.length', 'v.angle', 'v.normalized()',
+        'v.dot(w)', 'v.cross(w)', 'v.get_distance(w)',
+        'u.rotate(45)', 'u.rotate(0)', 'u.rotate(30)', 'v.rotated(45)',
+    ]
+ 
+    def benchmark():
+        "Time each operator (python vec2d.py bench)"
+        import timeit
+        names = {'vec2d': vec2d, 'v': vec2d(3.0, 4.0),
+                 'w': vec2d(1.5, -2.0), 't': (1.5, -2.0)}
+        for stmt in BENCHMARKS:
+            # u is the vector the in-place operators change
+            timer = timeit.Timer(stmt, "u = vec2d(3.0, 4.0)", globals=names)
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=5, number=number))/number
+            print("%-24s %8.1f ns" % (stmt, 1e9*best))
+ 
+    ####################################################################
+    import sys
+    if sys.argv[1:] == ['bench']:
+        benchmark()
+    else:
+        unittest.main()
  
     ######################################################################## 
\ No newline at end of file